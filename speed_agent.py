@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio agent: schedule -> measure -> submit -> log -> metrics as pipeline stages.
+
+run_once() in the autorun scripts does everything in sequence, so a slow form
+POST delays the next job. Here every stage is its own task, connected by
+bounded asyncio queues:
+
+    scheduler(s) --jobs--> measure --results--> submit --rows--> log --events--> metrics
+
+- Measurements run on a dedicated thread pool (speedtest is blocking) and never
+  wait on the stages after them: if the submit queue is full, the result goes
+  straight to the log as FAIL(queue) so `speed_replay.py` can pick it up later.
+- Form POSTs and CSV writes run on a separate I/O pool, so they never block the
+  event loop or the measurement threads.
+- With --sinks sinks.json, each measurement is handed to the fan-out sinks of
+  speed_sinks.py (forms, local CSV, JSONL, webhooks) instead of the built-in
+  submit/log stages; the metrics stage still sees every measurement.
+- One loop drives any number of schools (--schools schools.json); each school
+  has its own scheduler task with the same 07:00/13:30 catch-up rules as
+  submit_speed_and_send_official_autorun_v2.py.
+
+schools.json is a list of objects with school_code, sector, school_name,
+provider, line_number, service_type and optional device / form
+("official" | "experimental") / monthly_budget_mb (5G lines, see
+speed_budget.py) / source + engine_url (see below). Without it the v2
+script's school is used.
+
+A school with a fiber line and a 5G backup is listed once per line, each
+entry with its own line_number, service_type and "source" (interface name or
+local address, speed_bind.py): measurement and form POST then go out over
+that line only. --measure-concurrency 1 measures the lines back-to-back,
+2 measures them at the same time.
+
+When agents run on several PCs of the same school, --lease (shared directory
+or relay URL, see speed_lease.py) lets only one of them measure each line per
+slot; the others skip it or, with --lease-follower latency, log idle latency
+probes without submitting.
+
+Usage:
+    python speed_agent.py
+    python speed_agent.py --schools schools.json --measure-concurrency 1
+    python speed_agent.py --once          # run every school once, then exit
+    python speed_agent.py --lease \\\\SERVER\\speedtest\\leases
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import submit_speed_and_send_official_autorun_v2 as official
+from speed_dedup import DedupIndex, measurement_id
+from speed_forms import submit_record
+from speed_logwriter import get_writer
+from speed_record import Measurement
+from speed_budget import DataBudget, is_metered
+from speed_lease import claim, give_back, open_lease, slot_key
+from speed_sinks import load_dispatcher
+
+LOG_DIR = os.path.join(os.getcwd(), "logs")
+LOG_FILE = os.path.join(LOG_DIR, "speed_log.csv")
+DEDUP_FILE = os.path.join(LOG_DIR, "submitted_ids.jsonl")
+METRICS_FILE = os.path.join(LOG_DIR, "agent_metrics.json")
+
+QUEUE_SIZE = 100
+METRICS_EVERY_SEC = 60
+
+
+def default_school():
+    return {
+        "school_code": str(official.SCHOOL_CODE),
+        "sector": official.SCHOOL_SECTOR,
+        "school_name": official.SCHOOL_NAME,
+        "provider": official.SERVICE_PROVIDER,
+        "line_number": str(official.LINE_NUMBER),
+        "service_type": official.SERVICE_TYPE,
+        "device": official.DEVICE_NAME,
+        "form": "official",
+    }
+
+
+def load_schools(path):
+    if not path:
+        return [default_school()]
+    with open(path, encoding="utf-8") as f:
+        schools = json.load(f)
+    for s in schools:
+        if s["sector"] not in official.ALLOWED_SECTORS:
+            raise ValueError(f"Invalid sector '{s['sector']}'. Allowed: {official.ALLOWED_SECTORS}")
+        if s["provider"] not in official.ALLOWED_PROVIDERS:
+            raise ValueError(f"Invalid provider '{s['provider']}'. Allowed: {official.ALLOWED_PROVIDERS}")
+        s.setdefault("device", official.DEVICE_NAME)
+        s.setdefault("form", "official")
+        s["school_code"] = str(s["school_code"])
+        s["line_number"] = str(s["line_number"])
+    return schools
+
+
+def next_due(last_run, now):
+    """(when, label) of the next slot: today's missed slots first (catch-up), else the earliest upcoming."""
+    today = now.date()
+    upcoming = []
+    for (label, h, m) in official.SCHEDULES:
+        sched_today = datetime.combine(today, datetime.min.time()).replace(hour=h, minute=m)
+        if last_run.get(label) != today:
+            upcoming.append((now if sched_today <= now else sched_today, label))
+        else:
+            upcoming.append((sched_today + timedelta(days=1), label))
+    return min(upcoming)
+
+
+class Agent:
+    def __init__(self, schools, measure_concurrency=1, io_workers=8, once=False, sinks_path=None,
+                 lease=None, lease_follower="latency"):
+        self.schools = schools
+        self.once = once
+        self.jobs = asyncio.Queue(QUEUE_SIZE)
+        self.results = asyncio.Queue(QUEUE_SIZE)
+        self.rows = asyncio.Queue(QUEUE_SIZE)
+        self.events = asyncio.Queue(QUEUE_SIZE)
+        self.measure_pool = ThreadPoolExecutor(measure_concurrency, thread_name_prefix="measure")
+        self.io_pool = ThreadPoolExecutor(io_workers, thread_name_prefix="io")
+        self.measure_concurrency = measure_concurrency
+        self.dedup = DedupIndex(DEDUP_FILE)
+        self.writer = get_writer(LOG_FILE, official.LOG_HEADER)
+        self.budget = DataBudget(official.BUDGET_FILE)
+        self.lease = open_lease(lease)
+        self.lease_follower = lease_follower
+        self.dispatcher = None
+        if sinks_path:
+            self.dispatcher = load_dispatcher(self.dedup, sinks_path)
+        self.metrics = {"measured": 0, "measure_failed": 0, "submitted": 0, "submit_failed": 0,
+                        "duplicates": 0, "queue_overflow": 0, "logged": 0, "downgraded": 0,
+                        "lease_skipped": 0, "lease_follower": 0,
+                        "measure_sec_total": 0.0, "submit_sec_total": 0.0}
+
+    # ---- stage 1: schedulers (one per school) ----
+    async def scheduler(self, school):
+        if self.once:
+            await self.jobs.put((school, "manual"))
+            return
+        last_run = {}
+        while True:
+            now = datetime.now()
+            when, label = next_due(last_run, now)
+            wait = (when - now).total_seconds()
+            if wait > 0:
+                # nap in chunks so wall-clock jumps (sleep/wake) are noticed
+                await asyncio.sleep(min(wait, 300))
+                continue
+            last_run[label] = date.today()
+            await self.jobs.put((school, label))
+
+    # ---- stage 2: measurement ----
+    async def measure_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            school, label = await self.jobs.get()
+            print(f"\n[{school['school_code']} {label}] بدء القياس...")
+            started = time.monotonic()
+            key, holder = slot_key(school["school_code"], school["line_number"], label), None
+            if self.lease is not None:
+                held, info = await loop.run_in_executor(self.io_pool, claim, self.lease, key, school["device"])
+                if not held:
+                    holder = info["device"]
+                    if info.get("finished"):
+                        # already measured (possibly by this device before a restart): never twice
+                        print(f"[{school['school_code']} {label}] تم قياس هذا الخط في هذا الموعد "
+                              f"({holder}: {info.get('status')})؛ تم التخطي.")
+                        self.metrics["lease_skipped"] += 1
+                        self.jobs.task_done()
+                        continue
+                    print(f"[{school['school_code']} {label}] الجهاز {holder} يقيس هذا الخط في هذا الموعد.")
+                    if self.lease_follower == "skip":
+                        self.metrics["lease_skipped"] += 1
+                        self.jobs.task_done()
+                        continue
+                    self.metrics["lease_follower"] += 1
+            metered = is_metered(school["service_type"])
+            mode = "full" if holder is None else "latency"
+            if metered and holder is None:
+                limit = school.get("monthly_budget_mb", official.DATA_BUDGET_MB)
+                mode = await loop.run_in_executor(self.io_pool, self.budget.choose_mode, school["line_number"],
+                                                  limit, label, official.SCHEDULES)
+                if mode != "full":
+                    self.metrics["downgraded"] += 1
+            try:
+                results = await loop.run_in_executor(self.measure_pool, official.measure_speed, mode,
+                                                     school.get("source") or None, school.get("engine_url") or None)
+            except Exception as e:
+                if self.lease is not None and holder is None:
+                    await loop.run_in_executor(self.io_pool, give_back, self.lease, key, school["device"])
+                self.metrics["measure_failed"] += 1
+                print(f"[{school['school_code']} {label}] فشل القياس: {e}")
+                self.jobs.task_done()
+                continue
+            self.metrics["measured"] += 1
+            if metered:
+                # file lock + JSON read/write, possibly on a shared LEASE_DIR: keep it off the event loop
+                await loop.run_in_executor(self.io_pool, self.budget.charge, school["line_number"],
+                                           results["test_mode"], results["bytes_used"])
+            self.metrics["measure_sec_total"] += time.monotonic() - started
+            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            rec = Measurement.from_results(results, **school)
+            rec.update(timestamp=ts, schedule_label=label)
+            if holder is not None:
+                # follower: the holder submits this slot; keep the probes locally only
+                rec.update(submit_status=f"LEASE({holder})", used_mapping="None", used_hidden="None")
+                await self.rows.put(rec)
+                self.jobs.task_done()
+                continue
+            if results["test_mode"] == "latency":
+                # budget-downgraded: no throughput to submit, keep the probes locally only
+                rec.update(submit_status="NOT_SUBMITTED(latency)", used_mapping="None", used_hidden="None")
+                if self.lease is not None:
+                    await loop.run_in_executor(self.io_pool, give_back, self.lease, key, school["device"],
+                                               rec.submit_status)
+                await self.rows.put(rec)
+                self.jobs.task_done()
+                continue
+            if self.lease is not None:
+                await loop.run_in_executor(self.io_pool, give_back, self.lease, key, school["device"], "MEASURED")
+            if self.dispatcher is not None:
+                mid = measurement_id(rec["school_code"], rec["line_number"], ts)
+                self.dispatcher.dispatch(rec, mid)  # non-blocking fan-out
+                try:
+                    self.events.put_nowait(rec)  # the sinks log the row; metrics still see it
+                except asyncio.QueueFull:
+                    pass
+                self.jobs.task_done()
+                continue
+            try:
+                self.results.put_nowait((rec, school["form"]))
+            except asyncio.QueueFull:
+                # never let a slow form hold up measuring: log now, replay later
+                self.metrics["queue_overflow"] += 1
+                rec.update(submit_status="FAIL(queue)", used_mapping="None", used_hidden="None")
+                await self.rows.put(rec)
+            self.jobs.task_done()
+
+    # ---- stage 3: submission ----
+    async def submit_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            rec, form = await self.results.get()
+            mid = measurement_id(rec["school_code"], rec["line_number"], rec["timestamp"])
+            started = time.monotonic()
+            status, code = await loop.run_in_executor(
+                self.io_pool, submit_record, rec, mid, self.dedup, form)
+            self.metrics["submit_sec_total"] += time.monotonic() - started
+            key = {"SUCCESS": "submitted", "DUPLICATE": "duplicates"}.get(status, "submit_failed")
+            self.metrics[key] += 1
+            print(f"[{rec['school_code']} {rec['schedule_label']}] الإرسال: {status} (HTTP {code})")
+            rec.update(submit_status=status, used_mapping="None", used_hidden="None")
+            await self.rows.put(rec)
+            self.results.task_done()
+
+    # ---- stage 4: logging ----
+    async def log_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            rec = await self.rows.get()
+            await loop.run_in_executor(self.io_pool, self.writer.write, rec)
+            self.metrics["logged"] += 1
+            try:
+                self.events.put_nowait(rec)
+            except asyncio.QueueFull:
+                pass  # metrics are best-effort
+            self.rows.task_done()
+
+    # ---- stage 5: metrics ----
+    async def metrics_worker(self):
+        loop = asyncio.get_running_loop()
+        last_dump = 0.0
+        while True:
+            await self.events.get()
+            self.events.task_done()
+            if time.monotonic() - last_dump >= METRICS_EVERY_SEC or self.once:
+                last_dump = time.monotonic()
+                await loop.run_in_executor(self.io_pool, self.dump_metrics)
+
+    def dump_metrics(self):
+        snap = dict(self.metrics, updated=datetime.now().isoformat(timespec="seconds"),
+                    queues={"jobs": self.jobs.qsize(), "results": self.results.qsize(),
+                            "rows": self.rows.qsize(), "events": self.events.qsize()})
+        if self.dispatcher is not None:
+            snap["sinks"] = self.dispatcher.stats()
+        os.makedirs(LOG_DIR, exist_ok=True)
+        tmp = METRICS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snap, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, METRICS_FILE)
+
+    async def run(self):
+        workers = [asyncio.create_task(self.measure_worker()) for _ in range(self.measure_concurrency)]
+        workers += [asyncio.create_task(self.submit_worker()) for _ in range(4)]
+        workers += [asyncio.create_task(self.log_worker()), asyncio.create_task(self.metrics_worker())]
+        schedulers = [asyncio.create_task(self.scheduler(s)) for s in self.schools]
+        try:
+            await asyncio.gather(*schedulers)
+            # --once: drain every stage, then stop
+            for q in (self.jobs, self.results, self.rows):
+                await q.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if self.dispatcher is not None:
+                await asyncio.get_running_loop().run_in_executor(self.io_pool, self.dispatcher.drain, 120)
+            self.writer.flush()
+            self.dump_metrics()
+            self.measure_pool.shutdown(wait=False)
+            self.io_pool.shutdown(wait=False)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="وكيل غير متزامن لقياس السرعة والإرسال لعدة مدارس")
+    parser.add_argument("--schools", help="ملف JSON بقائمة المدارس")
+    parser.add_argument("--measure-concurrency", type=int, default=1,
+                        help="عدد القياسات المتزامنة (1 افتراضيًا لأن القياسات تتشارك الخط)")
+    parser.add_argument("--io-workers", type=int, default=8)
+    parser.add_argument("--once", action="store_true", help="قياس كل مدرسة مرة واحدة ثم الخروج")
+    parser.add_argument("--sinks", help="ملف JSON بوجهات الإرسال المتوازية (انظر speed_sinks.py)")
+    parser.add_argument("--lease", default=official.LEASE_DIR,
+                        help="مجلد مشترك أو عنوان وسيط التنسيق بين الأجهزة (انظر speed_lease.py)")
+    parser.add_argument("--lease-follower", choices=("skip", "latency"), default=official.LEASE_FOLLOWER,
+                        help="ما تفعله الأجهزة الأخرى في نفس الموعد")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    schools = load_schools(args.schools)
+    print(f"الوكيل يعمل لعدد {len(schools)} مدرسة؛ المواعيد: "
+          + ", ".join(label for (label, _, _) in official.SCHEDULES))
+    agent = Agent(schools, args.measure_concurrency, args.io_workers, args.once, args.sinks,
+                  args.lease, args.lease_follower)
+    try:
+        asyncio.run(agent.run())
+    except KeyboardInterrupt:
+        print("\nتم الإيقاف.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming per-school anomaly detection over logs/speed_log.csv.
+
+For every school (school code, or line number for rows without one) and
+metric (download, upload, ping) the detector keeps an EWMA baseline + EW
+variance and a one-sided CUSUM of the "worse" direction (drops for
+download/upload, rises for ping). Each new log row updates the state in O(1):
+
+- "sudden": one reading is more than Z_THRESHOLD deviations worse than baseline
+- "drift":  the CUSUM of small worse-than-baseline readings exceeds CUSUM_H
+
+Readings that are not comparable with the baseline (e.g. throughput of a
+short or latency-only budget run) are skipped, see speed_logformat.stat_value().
+
+State (baselines + log byte offset) is checkpointed to logs/anomaly_state.json,
+so a restart only reads rows appended since the last poll. Alerts are appended
+to logs/anomalies.csv. The autorun scripts poll after every run and, if
+ANOMALY_FOLLOWUP is switched on (off by default), take an immediate follow-up
+measurement when their own school is flagged; on metered lines the follow-up
+is subject to the data budget (speed_budget.py).
+
+Usage:
+    python speed_anomaly.py            # process new rows, print alerts
+    python speed_anomaly.py --reset    # rebuild baselines from the whole log
+"""
+
+import os
+import json
+import math
+import argparse
+
+from speed_logformat import iter_log, resync_offset, school_key, stat_value
+from speed_logwriter import get_writer
+
+LOG_DIR = os.path.join(os.getcwd(), "logs")
+LOG_FILE = os.path.join(LOG_DIR, "speed_log.csv")
+STATE_FILE = os.path.join(LOG_DIR, "anomaly_state.json")
+ALERTS_FILE = os.path.join(LOG_DIR, "anomalies.csv")
+ALERTS_HEADER = ["timestamp", "school", "metric", "kind", "value", "baseline", "score", "schedule_label"]
+
+# metric -> +1 if higher is worse, -1 if lower is worse
+METRICS = {"download_mbps": -1, "upload_mbps": -1, "ping_ms": +1}
+
+ALPHA = 0.1          # EWMA weight of the newest reading
+WARMUP = 5           # readings per school/metric before alerts are raised
+Z_THRESHOLD = 3.0    # single-reading deviation for a "sudden" alert
+CUSUM_K = 0.5        # slack (in deviations) absorbed per reading
+CUSUM_H = 4.0        # accumulated deviations for a "drift" alert
+REL_STD_FLOOR = 0.05  # std never below 5% of the baseline (stable lines are not hair-trigger)
+
+
+class AnomalyDetector:
+    def __init__(self, state_path=STATE_FILE, log_path=LOG_FILE, alerts_path=ALERTS_FILE):
+        self.state_path = state_path
+        self.log_path = log_path
+        self.alerts_path = alerts_path
+        self.offset = 0
+        self.schools = {}
+        if os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            self.offset = saved.get("offset", 0)
+            self.schools = saved.get("schools", {})
+
+    def reset(self):
+        self.offset = 0
+        self.schools = {}
+
+    def update(self, rec):
+        """Feed one log record; returns the list of alerts it raised."""
+        key = school_key(rec)
+        school = self.schools.setdefault(key, {})
+        alerts = []
+        for metric, direction in METRICS.items():
+            x = stat_value(rec, metric)
+            if x is None:
+                continue
+            st = school.get(metric)
+            if st is None:
+                school[metric] = {"n": 1, "mean": x, "var": 0.0, "cusum": 0.0}
+                continue
+            std = max(math.sqrt(st["var"]), REL_STD_FLOOR * abs(st["mean"]), 1e-9)
+            score = direction * (x - st["mean"]) / std
+            st["cusum"] = max(0.0, st["cusum"] + score - CUSUM_K)
+            if st["n"] >= WARMUP:
+                kind = None
+                if score > Z_THRESHOLD:
+                    kind = "sudden"
+                elif st["cusum"] > CUSUM_H:
+                    kind = "drift"
+                if kind:
+                    alerts.append({
+                        "timestamp": rec["timestamp"], "school": key, "metric": metric,
+                        "kind": kind, "value": x, "baseline": round(st["mean"], 2),
+                        "score": round(max(score, st["cusum"]), 2),
+                        "schedule_label": rec.get("schedule_label", ""),
+                    })
+                    st["cusum"] = 0.0
+            diff = x - st["mean"]
+            st["mean"] += ALPHA * diff
+            st["var"] = (1 - ALPHA) * (st["var"] + ALPHA * diff * diff)
+            st["n"] += 1
+        return alerts
+
+    def poll(self):
+        """Process rows appended since the last poll, checkpoint, and return new alerts."""
+        if not os.path.exists(self.log_path):
+            return []
+        start = resync_offset(self.log_path, self.offset)
+        if start == 0 and self.offset > 0:
+            self.reset()  # log was replaced; rebuild baselines from scratch
+        self.offset = start
+        alerts = []
+        for offset, rec in iter_log(self.log_path, start):
+            alerts.extend(self.update(rec))
+            self.offset = offset
+        if alerts:
+            writer = get_writer(self.alerts_path, ALERTS_HEADER)
+            for a in alerts:
+                writer.write(a)
+        self.save()
+        return alerts
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"offset": self.offset, "schools": self.schools}, f, ensure_ascii=False)
+        os.replace(tmp, self.state_path)
+
+
+def format_alert(a):
+    kind = "هبوط مفاجئ" if a["kind"] == "sudden" else "تدهور تدريجي"
+    return (f"[تنبيه] {a['timestamp']} مدرسة {a['school']}: {kind} في {a['metric']} "
+            f"= {a['value']} (خط الأساس {a['baseline']}, درجة {a['score']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="كشف التدهور في نتائج السرعة لكل مدرسة")
+    parser.add_argument("--log", default=LOG_FILE)
+    parser.add_argument("--state", default=STATE_FILE)
+    parser.add_argument("--reset", action="store_true", help="إعادة بناء خطوط الأساس من السجل كاملاً")
+    args = parser.parse_args()
+
+    detector = AnomalyDetector(args.state, args.log)
+    if args.reset:
+        detector.reset()
+    alerts = detector.poll()
+    for a in alerts:
+        print(format_alert(a))
+    print(f"تمت المعالجة حتى البايت {detector.offset}؛ عدد التنبيهات الجديدة: {len(alerts)}")
+
+
+if __name__ == "__main__":
+    main()
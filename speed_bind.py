@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bind measurements and form submissions to one line (interface / source address).
+
+Schools with both a fiber line and a 5G backup must say which one to test;
+otherwise the OS picks the route and the result may be recorded under the
+wrong LINE_NUMBER. A "source" is either an IPv4/IPv6 address or an interface
+name (resolved to its IPv4 address; psutil is used if installed, otherwise
+the Linux SIOCGIFADDR ioctl).
+
+Every connection is then opened from that address: speedtest-cli via its
+source_address option, the built-in engine and latency probes by binding
+their sockets, and form POSTs through a requests session whose connection
+pool binds to it (bound_session).
+
+Binding the source address selects the line when the OS routes by source
+(Windows with one gateway per adapter, or Linux with a policy rule such as
+`ip rule add from 192.168.8.10 table 100`). For tests on Linux, any
+127.0.0.0/8 address (127.0.0.2, 127.0.0.3, ...) can be used as a source
+without configuration; see speed_standin.py.
+"""
+
+import socket
+import functools
+import ipaddress
+import threading
+
+SIOCGIFADDR = 0x8915
+
+_sessions = {}
+_sessions_mutex = threading.Lock()
+
+
+def resolve_source(spec):
+    """IP address for a source spec ("", an IP, or an interface name); None means unbound."""
+    if not spec:
+        return None
+    try:
+        return str(ipaddress.ip_address(spec))
+    except ValueError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        for addr in psutil.net_if_addrs().get(spec, []):
+            if addr.family == socket.AF_INET:
+                return addr.address
+    else:
+        try:
+            import fcntl
+            import struct
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", spec[:15].encode()))
+            return socket.inet_ntoa(packed[20:24])
+        except (ImportError, OSError):
+            pass
+    raise ValueError(f"Interface '{spec}' not found or has no IPv4 address "
+                     "(on Windows install psutil or give the IP address)")
+
+
+@functools.lru_cache(maxsize=None)
+def adapter_class():
+    """HTTPAdapter subclass whose connections are opened from a fixed local address.
+
+    Built on first use so that importing this module does not import requests.
+    """
+    from requests.adapters import HTTPAdapter
+
+    class SourceAddressAdapter(HTTPAdapter):
+        def __init__(self, source, **kwargs):
+            self.source = source
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs["source_address"] = (self.source, 0)
+            super().init_poolmanager(*args, **kwargs)
+
+        def proxy_manager_for(self, *args, **kwargs):
+            kwargs["source_address"] = (self.source, 0)
+            return super().proxy_manager_for(*args, **kwargs)
+
+    return SourceAddressAdapter
+
+
+def make_session(source=None):
+    """A new requests session bound to `source` (plain session when unbound)."""
+    import requests
+    session = requests.Session()
+    address = resolve_source(source)
+    if address:
+        adapter = adapter_class()(address)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    return session
+
+
+def bound_session(source):
+    """Shared session for `source` (for form POSTs), or None when unbound."""
+    if not source:
+        return None
+    with _sessions_mutex:
+        if source not in _sessions:
+            _sessions[source] = make_session(source)
+        return _sessions[source]
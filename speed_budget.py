@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Monthly data budget for metered lines ("الجيل الخامس 5 G").
+
+Every measurement on a metered line is charged to a per-line, per-month
+account in logs/data_budget.json (bytes actually transferred, as reported by
+speedtest). The account also learns how many bytes each test mode costs on
+that line (EWMA), so the next run's cost can be estimated:
+
+    full     normal download + upload test
+    short    the same test cut to SHORT_TEST_SECONDS per direction
+    latency  no throughput test, only ping/idle latency probes
+
+Before each run choose_mode() picks the largest mode the budget allows while
+reserving a share for each of this month's remaining 07:00/13:30 slots: a
+full test only if every later slot can still get a short test, a short test
+only if every later slot can still get at least a latency run. Spending may
+run ahead of any pace line as long as that reserve holds, and when the budget
+cannot give every slot a short test, runs are kept short so that as many
+slots as possible get a throughput result. Any other run (anomaly follow-up,
+manual) must leave a short test for every later slot, so extra runs are the
+first to be downgraded. Latency-only runs are logged but not submitted.
+
+When several devices measure the same lines (speed_lease.py), BUDGET_FILE can
+be put in the shared lease directory; the file is re-read before every
+decision and charge, so each device sees the others' spending. Charges
+update the file under an advisory lock on BUDGET_FILE + ".lock" (the same
+lock the log writers use), so concurrent charges are never lost.
+
+Usage:
+    python speed_budget.py                 # show this month's accounts
+"""
+
+import os
+import json
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from speed_logwriter import locked_file
+
+LOG_DIR = os.path.join(os.getcwd(), "logs")
+BUDGET_FILE = os.path.join(LOG_DIR, "data_budget.json")
+
+METERED_SERVICE_TYPES = ("الجيل الخامس 5 G",)
+MONTHLY_BUDGET_MB = 5000      # default per-line allowance when none is configured
+SHORT_TEST_SECONDS = 4        # per direction in "short" mode (speedtest-cli default is 10)
+MODES = ("full", "short", "latency")
+# Starting estimates (bytes) until a line has its own history
+DEFAULT_COST = {"full": 250_000_000, "short": 100_000_000, "latency": 300_000}
+COST_ALPHA = 0.3              # EWMA weight of the newest observed cost
+MB = 1_000_000
+
+
+def is_metered(service_type):
+    return service_type in METERED_SERVICE_TYPES
+
+
+def month_of(now):
+    return now.strftime("%Y-%m")
+
+
+def month_slots(now, schedules, after=None):
+    """Scheduled slots in `now`'s month (only those strictly after `after`, if given)."""
+    count = 0
+    day = now.date().replace(day=1)
+    while day.month == now.month:
+        for (_, h, m) in schedules:
+            slot = datetime.combine(day, datetime.min.time()).replace(hour=h, minute=m)
+            if after is None or slot > after:
+                count += 1
+        day += timedelta(days=1)
+    return count
+
+
+class DataBudget:
+    def __init__(self, path=BUDGET_FILE):
+        self.path = path
+        self.lines = {}
+        self._mutex = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.lines = json.load(f)
+
+    def account(self, line, now=None):
+        """This month's account for a line (a new month starts from zero; learned costs are kept)."""
+        month = month_of(now or datetime.now())
+        acct = self.lines.setdefault(str(line), {"month": month, "used": 0, "runs": {}, "cost": {}})
+        if acct["month"] != month:
+            acct.update(month=month, used=0, runs={})
+        return acct
+
+    def estimate(self, line, mode):
+        return self.lines.get(str(line), {}).get("cost", {}).get(mode, DEFAULT_COST[mode])
+
+    def choose_mode(self, line, limit_mb, label, schedules, now=None):
+        """Largest test mode that leaves the reserve of this month's later slots."""
+        now = now or datetime.now()
+        with self._mutex:
+            self._load()
+            acct = self.account(line, now)
+            remaining = limit_mb * MB - acct["used"]
+            later = month_slots(now, schedules, after=now)
+            extra = label not in {lbl for (lbl, _, _) in schedules}
+            for i, mode in enumerate(MODES[:-1]):
+                # each later slot keeps at least the next smaller mode (a short test for extra runs)
+                floor = "short" if extra else MODES[i + 1]
+                if remaining - self.estimate(line, mode) >= later * self.estimate(line, floor):
+                    return mode
+            return "latency"
+
+    def charge(self, line, mode, nbytes, now=None):
+        """Record bytes used by one run and update the learned cost of its mode."""
+        nbytes = int(nbytes or 0)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._mutex, locked_file(self.path + ".lock", "a+b"):
+            self._load()
+            acct = self.account(line, now)
+            acct["used"] += nbytes
+            acct["runs"][mode] = acct["runs"].get(mode, 0) + 1
+            if nbytes:
+                old = acct["cost"].get(mode)
+                acct["cost"][mode] = nbytes if old is None else round(old + COST_ALPHA * (nbytes - old))
+            self.save()
+        return acct
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.lines, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+
+def mode_note(rec):
+    """Notes-field remark for downgraded runs, or "" for a full test."""
+    mode = rec.get("test_mode")
+    if mode == "short":
+        return f"اختبار مختصر ({SHORT_TEST_SECONDS} ث) لتوفير باقة البيانات"
+    if mode == "latency":
+        return "قياس التأخير فقط (نفدت حصة باقة البيانات لهذا الشهر)"
+    return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="استهلاك باقة البيانات الشهرية لخطوط 5G")
+    parser.add_argument("--file", default=BUDGET_FILE)
+    parser.add_argument("--limit-mb", type=float, default=MONTHLY_BUDGET_MB)
+    args = parser.parse_args()
+
+    budget = DataBudget(args.file)
+    if not budget.lines:
+        print("لا توجد حسابات بعد.")
+    for line in sorted(budget.lines):
+        acct = budget.account(line)
+        costs = ", ".join(f"{m}≈{budget.estimate(line, m) / MB:.1f}MB" for m in MODES)
+        print(f"الخط {line} [{acct['month']}]: {acct['used'] / MB:.1f} / {args.limit_mb:g} MB | "
+              f"تشغيلات {acct['runs']} | {costs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+One entry point for every script and tool, as subcommands.
+
+    python speed_cli.py measure [--backend speedtest|ookla|engine] [--mode] [--source] [--url]
+    python speed_cli.py run [--label manual]        # v2: measure + submit + log once
+    python speed_cli.py status                      # latest rows, data budget, agent metrics
+    python speed_cli.py backends | sinks            # what the registry offers (speed_registry.py)
+    python speed_cli.py startup [--runs 5]          # cold-start time of the non-measuring commands
+
+    python speed_cli.py form ...        submit_speed_to_form.py
+    python speed_cli.py official ...    submit_speed_and_send_official.py
+    python speed_cli.py autorun ...     submit_speed_and_send_autorun.py
+    python speed_cli.py autorun-v2 ...  submit_speed_and_send_official_autorun_v2.py
+    python speed_cli.py agent | replay | dashboard | rollup | anomaly | budget |
+                        lease | standin | schedsim ...   the speed_*.py tools
+
+The other scripts keep working on their own; the subcommands above pass
+their arguments straight through. Nothing is imported until a subcommand is
+chosen, and speedtest / requests are only imported by the code that measures
+or sends, so `status`, `backends`, `budget`, `--help` etc. start in about the
+time of the interpreter itself. `startup` checks that: it times each light
+command in a fresh interpreter and fails if one exceeds STARTUP_BUDGET_MS over
+a bare `python -c pass` or imports a module from HEAVY_MODULES.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+LOG_DIR = os.path.join(os.getcwd(), "logs")
+LOG_FILE = os.path.join(LOG_DIR, "speed_log.csv")
+METRICS_FILE = os.path.join(LOG_DIR, "agent_metrics.json")
+STATUS_TAIL_BYTES = 256 * 1024   # only the end of the log is read for `status`
+
+HEAVY_MODULES = ("requests", "urllib3", "speedtest", "psutil")
+STARTUP_BUDGET_MS = 150
+STARTUP_COMMANDS = [
+    ["--help"], ["backends"], ["sinks"], ["status"], ["budget"],
+    ["replay", "--help"], ["agent", "--help"], ["dashboard", "--help"],
+    ["lease", "show", "--lease", os.path.join("logs", "leases")],
+]
+TRACE_ENV = "SPEED_CLI_TRACE_IMPORTS"
+
+# name -> ("module:function", help); the function parses sys.argv itself
+DELEGATED = {
+    "form": ("submit_speed_to_form:main", "قياس وإرسال إلى النموذج الرسمي مع وسائط سطر الأوامر"),
+    "official": ("submit_speed_and_send_official:main", "قياس وإرسال مرة واحدة (النموذج الرسمي)"),
+    "autorun": ("submit_speed_and_send_autorun:main", "تشغيل تلقائي 07:00/13:30 (النموذج التجريبي)"),
+    "autorun-v2": ("submit_speed_and_send_official_autorun_v2:main", "تشغيل تلقائي 07:00/13:30 (النموذج الرسمي)"),
+    "agent": ("speed_agent:main", "الوكيل غير المتزامن لعدة مدارس"),
+    "replay": ("speed_replay:main", "إعادة إرسال القياسات الفاشلة"),
+    "dashboard": ("speed_dashboard:main", "لوحة HTML ثابتة"),
+    "rollup": ("speed_rollup:main", "تجميعات sqlite"),
+    "anomaly": ("speed_anomaly:main", "كشف التدهور"),
+    "budget": ("speed_budget:main", "باقة البيانات الشهرية لخطوط 5G"),
+    "lease": ("speed_lease:main", "التنسيق بين أجهزة المدرسة"),
+    "standin": ("speed_standin:main", "خادم قياس محلي بديل"),
+    "schedsim": ("speed_schedsim:main", "محاكاة المجدول بساعة افتراضية"),
+}
+
+
+def delegate(name, argv):
+    import importlib
+    module, _, func = DELEGATED[name][0].partition(":")
+    sys.argv = [f"speed_cli.py {name}"] + list(argv)
+    getattr(importlib.import_module(module), func)()
+
+
+# ---- built-in commands ----
+def cmd_measure(args):
+    from speed_registry import get_backend
+    results = get_backend(args.backend)(mode=args.mode, source=args.source, url=args.url)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+def cmd_run(args):
+    import submit_speed_and_send_official_autorun_v2 as official
+    official.run_once(args.label)
+
+
+def cmd_list(args):
+    import speed_registry
+    table = getattr(speed_registry, args.table)
+    for name in speed_registry.names(table):
+        target, help_text = table[name]
+        print(f"{name:<12} {help_text}  [{target}]")
+
+
+def cmd_status(args):
+    from speed_logformat import current_status, iter_log, load_status_updates, resync_offset, school_key
+    from speed_budget import BUDGET_FILE, DataBudget, MB
+    latest = {}
+    if os.path.exists(LOG_FILE):
+        start = resync_offset(LOG_FILE, max(0, os.path.getsize(LOG_FILE) - STATUS_TAIL_BYTES))
+        for _, rec in iter_log(LOG_FILE, start):
+            latest[(school_key(rec), rec["line_number"])] = rec
+    if not latest:
+        print("لا توجد قياسات في السجل بعد.")
+    updates = load_status_updates() if latest else {}
+    for (school, line), rec in sorted(latest.items()):
+        print(f"{school} / الخط {line}: {rec['timestamp']} | تنزيل {rec['download_mbps']} | "
+              f"رفع {rec['upload_mbps']} | Ping {rec['ping_ms']} | {current_status(rec, updates) or '-'}")
+
+    if os.path.exists(BUDGET_FILE):
+        budget = DataBudget(BUDGET_FILE)
+        for line in sorted(budget.lines):
+            acct = budget.account(line)
+            print(f"باقة الخط {line} [{acct['month']}]: {acct['used'] / MB:.0f} MB | تشغيلات {acct['runs']}")
+
+    if os.path.exists(METRICS_FILE):
+        with open(METRICS_FILE, encoding="utf-8") as f:
+            m = json.load(f)
+        print(f"الوكيل ({m.get('updated')}): قياسات {m.get('measured')} | إرسال {m.get('submitted')} | "
+              f"فشل {m.get('submit_failed')} | طوابير {m.get('queues')}")
+
+
+def _time_command(argv, runs):
+    """Median wall time (ms) of `python argv` and the heavy modules it imported."""
+    env = dict(os.environ, **{TRACE_ENV: "1"})
+    times, heavy = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable] + argv, env=env, stdin=subprocess.DEVNULL,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        times.append((time.perf_counter() - started) * 1000)
+        for line in proc.stderr.splitlines():
+            if line.startswith(TRACE_ENV):
+                heavy = json.loads(line.partition(" ")[2])
+    times.sort()
+    return times[len(times) // 2], heavy
+
+
+def cmd_startup(args):
+    base, _ = _time_command(["-c", "pass"], args.runs)
+    print(f"{'python -c pass':<28} {base:7.1f} ms")
+    failed = False
+    for cmd in STARTUP_COMMANDS:
+        ms, heavy = _time_command([os.path.abspath(__file__)] + cmd, args.runs)
+        over = ms - base
+        bad = heavy or over > args.budget_ms
+        failed = failed or bad
+        note = f"  يستورد: {', '.join(heavy)}" if heavy else ""
+        print(f"{' '.join(cmd):<28} {ms:7.1f} ms (+{over:.1f}){'  ✗' if bad else ''}{note}")
+    print(f"الحد: +{args.budget_ms:g} ms فوق المفسّر ودون استيراد {', '.join(HEAVY_MODULES)}")
+    if failed:
+        sys.exit(1)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="speed_cli.py", description="نقطة دخول موحدة لأدوات قياس السرعة والإرسال",
+        epilog="أوامر إضافية (تمرَّر وسائطها كما هي): "
+               + " | ".join(f"{name}: {help_text}" for name, (_, help_text) in DELEGATED.items()))
+    sub = parser.add_subparsers(dest="cmd", metavar="command")
+
+    p = sub.add_parser("measure", help="قياس فقط وطباعة النتيجة (دون إرسال أو تسجيل)")
+    p.add_argument("--backend", default="speedtest", help="انظر: speed_cli.py backends")
+    p.add_argument("--mode", choices=("full", "short", "latency"), default="full")
+    p.add_argument("--source", help="واجهة الشبكة أو عنوان المصدر")
+    p.add_argument("--url", help="عنوان خادم المحرك المدمج")
+    p.set_defaults(func=cmd_measure)
+
+    p = sub.add_parser("run", help="قياس وإرسال وتسجيل مرة واحدة بإعدادات autorun-v2")
+    p.add_argument("--label", default="manual")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("status", help="آخر القياسات واستهلاك الباقة ومؤشرات الوكيل")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser("backends", help="محركات القياس المسجلة")
+    p.set_defaults(func=cmd_list, table="BACKENDS")
+
+    p = sub.add_parser("sinks", help="أنواع وجهات الإرسال المسجلة")
+    p.set_defaults(func=cmd_list, table="SINKS")
+
+    p = sub.add_parser("startup", help="قياس زمن بدء الأوامر التي لا تقيس")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    p.set_defaults(func=cmd_startup)
+    return parser
+
+
+def trace_imports():
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    print(f"{TRACE_ENV} {json.dumps(loaded)}", file=sys.stderr)
+
+
+def main(argv=None):
+    import atexit
+    argv = sys.argv[1:] if argv is None else argv
+    if os.environ.get(TRACE_ENV):
+        atexit.register(trace_imports)
+    if argv and argv[0] in DELEGATED:
+        delegate(argv[0], argv[1:])
+        return
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.cmd is None:
+        parser.print_help()
+        return
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
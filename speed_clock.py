@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Clocks for the schedulers (loop_scheduler in the autorun scripts).
+
+SystemClock is the real thing (datetime.now / date.today / time.sleep).
+VirtualClock lets a simulation run months of schedule time in seconds:
+sleep() and advance() move time forward instantly, and scripted events model
+what happens to a school PC in real life:
+
+    suspend  the machine sleeps for `minutes` at `at`; a sleep() or a running
+             measurement in progress is frozen and resumes after wake
+             (like time.monotonic on Linux/Windows, which stops during suspend)
+    jump     the wall clock is stepped by `minutes` at `at` (NTP correction,
+             wrong BIOS time, manual change); negative = backwards
+
+Event times are given in "true" time (the simulation's reference timeline, equal
+to the wall clock until the first jump). The clock raises SimulationEnd once
+true time reaches `end`.
+"""
+
+import time
+from datetime import datetime, date, timedelta
+
+TS_FORMAT = "%Y-%m-%d %H:%M"
+
+
+class SimulationEnd(Exception):
+    """Raised by VirtualClock when the simulated period is over."""
+
+
+class SystemClock:
+    def now(self):
+        return datetime.now()
+
+    def today(self):
+        return date.today()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    def __init__(self, start, end, events=()):
+        self.true = start
+        self.end = end
+        self.offset = timedelta(0)
+        self.events = sorted(events, key=lambda ev: ev["at"])
+        self.suspended = timedelta(0)
+
+    def now(self):
+        return self.true + self.offset
+
+    def today(self):
+        return self.now().date()
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        """Let `seconds` of process time pass, applying any events that fall inside."""
+        target = self.true + timedelta(seconds=seconds)
+        while self.events and self.events[0]["at"] <= target:
+            ev = self.events.pop(0)
+            at = max(ev["at"], self.true)
+            if ev["type"] == "suspend":
+                remaining = target - at
+                self.true = at + timedelta(minutes=ev["minutes"])
+                self.suspended += timedelta(minutes=ev["minutes"])
+                target = self.true + remaining
+            elif ev["type"] == "jump":
+                self.offset += timedelta(minutes=ev["minutes"])
+            else:
+                raise ValueError(f"Unknown clock event type '{ev['type']}'. Allowed: suspend, jump")
+        self.true = target
+        if self.true >= self.end:
+            raise SimulationEnd()
+
+
+def parse_event(ev):
+    """{"at": "2025-01-31 06:30", "type": "suspend", "minutes": 600} -> event with datetime `at`."""
+    return dict(ev, at=datetime.strptime(ev["at"][:16].replace("T", " "), TS_FORMAT))
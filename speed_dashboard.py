@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Static HTML dashboard for logs/speed_log.csv (self-contained: inline CSS + SVG, no JS).
+
+    site/index.html                 fleet overview (all sectors)
+    site/sector-<id>.html           schools of one sector + sector trend
+    site/school-<key>.html          one school: daily trends + recent failures
+
+Builds are incremental: only log rows appended since the last build are read
+(byte offset in site/.state.json); they refresh the rollups (speed_rollup.py,
+rollups.sqlite next to the log unless --db is given) and mark which
+schools/sectors changed. Only those pages and index.html are re-rendered;
+charts and tables are drawn from the rollups, not from raw rows. On the first
+build of a new day every sector page and index.html are re-rendered too, so
+the OVERVIEW_DAYS summaries move with the date; a school that changed sector
+also refreshes its old sector page. Failed submissions later acknowledged
+(replay, logs/status_updates.csv) drop off the failure lists.
+
+Usage:
+    python speed_dashboard.py                  # incremental build into ./site
+    python speed_dashboard.py --full           # re-render every page
+    python speed_dashboard.py --out D:\\site --log D:\\logs\\speed_log.csv
+"""
+
+import os
+import json
+import html
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+
+import speed_rollup
+from speed_logformat import STATUS_FILE, current_status, iter_log, load_status_updates, resync_offset, row_id, school_key
+
+LOG_DIR = os.path.join(os.getcwd(), "logs")
+LOG_FILE = os.path.join(LOG_DIR, "speed_log.csv")
+SITE_DIR = os.path.join(os.getcwd(), "site")
+
+OVERVIEW_DAYS = 30      # window for the summary numbers on index/sector pages
+FAILURES_KEPT = 50      # most recent failed submissions listed per school
+
+CSS = """
+body{font-family:Tahoma,Arial,sans-serif;margin:24px;background:#f7f7f9;color:#222}
+h1,h2{color:#1d3557} a{color:#1d3557}
+table{border-collapse:collapse;background:#fff;margin:12px 0}
+th,td{border:1px solid #ddd;padding:6px 10px;text-align:center}
+th{background:#e9ecef} .fail{color:#b00020}
+.chart{background:#fff;border:1px solid #ddd;margin:8px 0}
+"""
+
+
+# -------- Small HTML helpers --------
+def esc(v):
+    return html.escape("" if v is None else str(v))
+
+
+def page(title, body, updated):
+    return (f'<!doctype html><html lang="ar" dir="rtl"><head><meta charset="utf-8">'
+            f"<title>{esc(title)}</title><style>{CSS}</style></head><body>"
+            f'<p><a href="index.html">الرئيسية</a></p><h1>{esc(title)}</h1>{body}'
+            f"<p><small>آخر تحديث: {esc(updated)}</small></p></body></html>")
+
+
+class Raw(str):
+    """A pre-rendered <td> cell that table() must not escape."""
+
+
+def table(headers, rows):
+    head = "".join(f"<th>{esc(h)}</th>" for h in headers)
+    body = "".join("<tr>" + "".join(c if isinstance(c, Raw) else f"<td>{esc(c)}</td>" for c in r) + "</tr>"
+                   for r in rows)
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+def svg_chart(points, title, width=720, height=180):
+    """Line chart of [(label, value)] as inline SVG."""
+    if not points:
+        return f"<p>{esc(title)}: لا توجد بيانات</p>"
+    values = [v for _, v in points]
+    lo, hi = min(values), max(values)
+    span = (hi - lo) or 1.0
+    pad = 30
+    n = max(len(points) - 1, 1)
+    xy = [(pad + i * (width - 2 * pad) / n, height - pad - (v - lo) * (height - 2 * pad) / span)
+          for i, (_, v) in enumerate(points)]
+    poly = " ".join(f"{x:.1f},{y:.1f}" for x, y in xy)
+    return (f'<h3>{esc(title)}</h3><svg class="chart" width="{width}" height="{height}" '
+            f'xmlns="http://www.w3.org/2000/svg" direction="ltr">'
+            f'<polyline fill="none" stroke="#457b9d" stroke-width="2" points="{poly}"/>'
+            f'<text x="{pad}" y="14" font-size="11">max {hi}</text>'
+            f'<text x="{pad}" y="{height - 8}" font-size="11">min {lo} | {esc(points[0][0])} → {esc(points[-1][0])}</text>'
+            f"</svg>")
+
+
+def sector_file(sector):
+    return f"sector-{hashlib.sha1(sector.encode('utf-8')).hexdigest()[:10]}.html"
+
+
+def school_file(key):
+    return f"school-{key.replace(':', '-')}.html"
+
+
+# -------- State --------
+def load_state(path):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {"offset": 0, "schools": {}, "failures": {}, "built_on": None}
+
+
+def save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def scan_new_rows(state, log_path, updates):
+    """Read rows since the last build; update school metadata/failures.
+
+    Returns (changed school keys, sectors that lost a school).
+    """
+    changed, left = set(), set()
+    start = resync_offset(log_path, state["offset"])
+    if start == 0 and state["offset"] > 0:
+        state.update(schools={}, failures={})  # log replaced
+    state["offset"] = start
+    for offset, rec in iter_log(log_path, start):
+        key = school_key(rec)
+        changed.add(key)
+        info = state["schools"].setdefault(key, {})
+        if info.get("sector") not in (None, rec["sector"]):
+            left.add(info["sector"])
+        info.update(name=rec["school_name"] or info.get("name", ""), sector=rec["sector"],
+                    provider=rec["provider"], service_type=rec["service_type"], last=rec["timestamp"])
+        status = current_status(rec, updates)
+        if status.startswith("FAIL"):
+            mid = row_id(rec)
+            fails = state["failures"].setdefault(key, [])
+            fails.append([rec["timestamp"], rec["schedule_label"], status, rec["download_mbps"], mid])
+            del fails[:-FAILURES_KEPT]
+        state["offset"] = offset
+    return changed, left
+
+
+def apply_status_updates(state, updates):
+    """Drop/refresh listed failures whose status changed since; returns the affected school keys."""
+    changed = set()
+    for key, fails in state["failures"].items():
+        kept = []
+        for entry in fails:
+            new = updates.get(entry[4]) if len(entry) > 4 else None
+            if new is not None and new != entry[2]:
+                changed.add(key)
+                if not new.startswith("FAIL"):
+                    continue
+                entry[2] = new
+            kept.append(entry)
+        fails[:] = kept
+    return changed
+
+
+# -------- Pages --------
+def summary_row(dim, key, since, db_path):
+    d = speed_rollup.query(dim, key, since, metric="download_mbps", quantiles=(0.1, 0.5), db_path=db_path)
+    u = speed_rollup.query(dim, key, since, metric="upload_mbps", quantiles=(0.5,), db_path=db_path)
+    p = speed_rollup.query(dim, key, since, metric="ping_ms", quantiles=(0.5, 0.9), db_path=db_path)
+    return [d["count"], d["mean"], d["p50"], d["p10"], u["mean"], p["p50"], p["p90"]]
+
+
+SUMMARY_HEADERS = ["عدد القياسات", "متوسط التنزيل", "وسيط التنزيل", "تنزيل p10", "متوسط الرفع",
+                   "وسيط Ping", "Ping p90"]
+
+
+def render_school(key, info, failures, updated, db_path):
+    charts = []
+    for metric, title in (("download_mbps", "التنزيل اليومي (Mbps)"), ("upload_mbps", "الرفع اليومي (Mbps)"),
+                          ("ping_ms", "Ping اليومي (ms)")):
+        points = speed_rollup.series("school", key, metric, db_path=db_path)
+        charts.append(svg_chart([(b, mean) for b, _, mean, _, _ in points], title))
+    fail_rows = [[t, lbl, Raw(f'<td class="fail">{esc(st)}</td>'), dl] for t, lbl, st, dl, *_ in reversed(failures)]
+    body = (f"<p>القطاع: <a href='{sector_file(info['sector'])}'>{esc(info['sector'])}</a> | "
+            f"المزود: {esc(info['provider'])} | الخدمة: {esc(info['service_type'])} | "
+            f"آخر قياس: {esc(info.get('last'))}</p>" + "".join(charts)
+            + "<h2>آخر الإرسالات الفاشلة</h2>"
+            + (table(["الوقت", "الموعد", "الحالة", "التنزيل"], fail_rows) if fail_rows else "<p>لا يوجد</p>"))
+    return page(f"{info.get('name') or key} ({key})", body, updated)
+
+
+def render_sector(sector, schools, since, updated, db_path):
+    rows = []
+    for key, info in sorted(schools.items()):
+        link = Raw(f"<td><a href='{school_file(key)}'>{esc(info.get('name') or key)}</a></td>")
+        rows.append([link, key] + summary_row("school", key, since, db_path))
+    points = speed_rollup.series("sector", sector, "download_mbps", db_path=db_path)
+    trend = svg_chart([(b, mean) for b, _, mean, _, _ in points], "متوسط التنزيل اليومي للقطاع (Mbps)")
+    body = trend + f"<h2>المدارس (آخر {OVERVIEW_DAYS} يومًا)</h2>" + table(["المدرسة", "الرمز"] + SUMMARY_HEADERS, rows)
+    return page(f"قطاع {sector}", body, updated)
+
+
+def render_index(sectors, state, since, updated, db_path):
+    rows = []
+    for sector in sorted(sectors):
+        link = Raw(f"<td><a href='{sector_file(sector)}'>{esc(sector)}</a></td>")
+        rows.append([link, len(sectors[sector])] + summary_row("sector", sector, since, db_path))
+    fail_count = sum(len(v) for v in state["failures"].values())
+    body = (f"<p>عدد المدارس: {len(state['schools'])} | إرسالات فاشلة حديثة: {fail_count}</p>"
+            f"<h2>القطاعات (آخر {OVERVIEW_DAYS} يومًا)</h2>"
+            + table(["القطاع", "المدارس"] + SUMMARY_HEADERS, rows))
+    return page("لوحة قياس سرعة الإنترنت في المدارس", body, updated)
+
+
+def write(out_dir, name, text):
+    tmp = os.path.join(out_dir, name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, os.path.join(out_dir, name))
+
+
+def default_db(log_path):
+    """rollups.sqlite next to the log (so --log elsewhere does not mix into ./logs)."""
+    return os.path.join(os.path.dirname(os.path.abspath(log_path)), os.path.basename(speed_rollup.DB_FILE))
+
+
+def build(log_path=LOG_FILE, out_dir=SITE_DIR, full=False, db_path=None):
+    """Incrementally (re)build the site; returns the number of pages written."""
+    db_path = db_path or default_db(log_path)
+    os.makedirs(out_dir, exist_ok=True)
+    state_path = os.path.join(out_dir, ".state.json")
+    state = load_state(state_path)
+    updates = load_status_updates(os.path.join(os.path.dirname(os.path.abspath(log_path)),
+                                               os.path.basename(STATUS_FILE)))
+    changed, left = scan_new_rows(state, log_path, updates) if os.path.exists(log_path) else (set(), set())
+    changed |= apply_status_updates(state, updates)
+    speed_rollup.update(log_path, db_path)
+    today = datetime.now().strftime("%Y-%m-%d")
+    new_day = state.get("built_on") != today
+    if full:
+        changed = set(state["schools"])
+
+    sectors = {}
+    for key, info in state["schools"].items():
+        sectors.setdefault(info["sector"], {})[key] = info
+    changed_sectors = {state["schools"][k]["sector"] for k in changed} | left
+    if full or new_day:
+        changed_sectors |= set(sectors)  # the OVERVIEW_DAYS window moved
+
+    updated = datetime.now().strftime("%Y-%m-%d %H:%M")
+    since = (datetime.now() - timedelta(days=OVERVIEW_DAYS)).strftime("%Y-%m-%d")
+    written = 0
+    for key in changed:
+        write(out_dir, school_file(key),
+              render_school(key, state["schools"][key], state["failures"].get(key, []), updated, db_path))
+        written += 1
+    for sector in changed_sectors:
+        write(out_dir, sector_file(sector), render_sector(sector, sectors.get(sector, {}), since, updated, db_path))
+        written += 1
+    if changed or changed_sectors or not os.path.exists(os.path.join(out_dir, "index.html")):
+        write(out_dir, "index.html", render_index(sectors, state, since, updated, db_path))
+        written += 1
+    state["built_on"] = today
+    save_state(state_path, state)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="إنشاء لوحة HTML ثابتة من سجل السرعة")
+    parser.add_argument("--log", default=LOG_FILE)
+    parser.add_argument("--out", default=SITE_DIR)
+    parser.add_argument("--db", help="قاعدة التجميعات (افتراضيًا rollups.sqlite بجانب ملف السجل)")
+    parser.add_argument("--full", action="store_true", help="إعادة إنشاء جميع الصفحات")
+    args = parser.parse_args()
+    written = build(args.log, args.out, args.full, args.db)
+    print(f"تم تحديث {written} صفحة في: {os.path.abspath(args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Idempotent submissions: stable measurement IDs + a local dedup index.
+
+Every measurement gets an ID derived from (school code, line number, timestamp),
+so the same measurement always maps to the same ID - across payload variants,
+mapping tries, retries and restarts. Acknowledged submissions are appended to
+logs/submitted_ids.jsonl; the scripts check the index before every POST.
+
+The index is append-only JSON lines and is re-read incrementally (from the last
+byte offset) before each check, so several scripts/processes sharing the same
+logs folder see each other's acknowledgements. One index may be shared by
+several threads (replay workers, agent submit workers, sink threads), so the
+refresh and mark steps run under a lock.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+DEDUP_FILE = os.path.join(os.getcwd(), "logs", "submitted_ids.jsonl")
+
+
+def measurement_id(school_code, line_number, ts):
+    """Stable short ID for one measurement. `ts` is 'YYYY-MM-DD HH:MM:SS' or ISO format."""
+    ts = str(ts).replace("T", " ")[:19]
+    raw = f"{school_code}|{line_number}|{ts}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def form_key(form_url):
+    """Reduce a form action URL to its form ID (u/2/ and /d/e/ variants map to one key)."""
+    parts = [p for p in form_url.split("/") if p]
+    if "e" in parts and parts.index("e") + 1 < len(parts):
+        return parts[parts.index("e") + 1]
+    return form_url
+
+
+class DedupIndex:
+    """Append-only index of (form, measurement_id) pairs already acknowledged by the form."""
+
+    def __init__(self, path=DEDUP_FILE):
+        self.path = path
+        self._seen = set()
+        self._offset = 0
+        self._mutex = threading.Lock()
+        with self._mutex:
+            self._refresh()
+
+    def _refresh(self):
+        """Read records appended since the last refresh; caller holds self._mutex."""
+        if not os.path.exists(self.path):
+            return
+        offset = self._offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partial line being written by another process
+                offset += len(line)
+                try:
+                    rec = json.loads(line)
+                    self._seen.add((rec["form"], rec["id"]))
+                except (ValueError, KeyError):
+                    continue
+        self._offset = offset
+
+    def seen(self, form_url, mid):
+        with self._mutex:
+            self._refresh()
+            return (form_key(form_url), mid) in self._seen
+
+    def mark(self, form_url, mid, status_code=None):
+        key = (form_key(form_url), mid)
+        with self._mutex:
+            if key not in self._seen:
+                self._append(key, status_code)
+
+    def _append(self, key, status_code):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        rec = {
+            "form": key[0],
+            "id": key[1],
+            "status": status_code,
+            "at": datetime.now().isoformat(timespec="seconds"),
+        }
+        # One write() per record in append mode keeps lines whole across processes
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._seen.add(key)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Built-in HTTP speed test engine (no speedtest.net dependency).
+
+Measures against any server exposing the speed_standin.py endpoints
+(/latency.txt, /download?bytes=N, /upload, optional /whoami): ping is the
+fastest of a few small GETs, download/upload run STREAMS parallel
+connections for a fixed time, and latency probes run alongside as with
+speedtest-cli (speed_latency.py). All connections, including probes, are
+opened from the chosen source address (speed_bind.py), so the result
+belongs to exactly one line.
+
+Returns the same result dict as measure_speed() in the autorun scripts.
+
+Usage:
+    python speed_engine.py http://127.0.0.1:8099 --source 127.0.0.2
+    python speed_engine.py http://10.0.0.5:8099 --source eth1 --mode short
+"""
+
+import json
+import time
+import argparse
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from speed_bind import make_session, resolve_source
+from speed_budget import SHORT_TEST_SECONDS
+from speed_latency import probe_during, probe_idle
+
+TEST_SECONDS = 10
+STREAMS = 4
+DOWNLOAD_REQUEST_BYTES = 25_000_000
+UPLOAD_REQUEST_BYTES = 2_000_000
+PING_SAMPLES = 5
+TIMEOUT = 15
+
+
+def _download_stream(session, base, deadline):
+    got = 0
+    while time.monotonic() < deadline:
+        with session.get(f"{base}/download?bytes={DOWNLOAD_REQUEST_BYTES}", stream=True, timeout=TIMEOUT) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(64 * 1024):
+                got += len(chunk)
+                if time.monotonic() >= deadline:
+                    break
+    return got
+
+
+def _upload_stream(session, base, deadline):
+    payload = bytes(UPLOAD_REQUEST_BYTES)
+    sent = 0
+    while time.monotonic() < deadline:
+        session.post(f"{base}/upload", data=payload, timeout=TIMEOUT).raise_for_status()
+        sent += len(payload)
+    return sent
+
+
+def _parallel(stream_fn, base, source, seconds, streams):
+    """Run `streams` connections of stream_fn for `seconds`; returns (bytes, elapsed_seconds)."""
+    started = time.monotonic()
+    deadline = started + seconds
+    with ThreadPoolExecutor(streams) as pool:
+        futures = [pool.submit(stream_fn, make_session(source), base, deadline) for _ in range(streams)]
+        total = sum(f.result() for f in futures)
+    return total, time.monotonic() - started
+
+
+def measure_http(base_url, source=None, mode="full", seconds=TEST_SECONDS, streams=STREAMS):
+    base = base_url.rstrip("/")
+    url = urlparse(base)
+    address = (url.hostname, url.port or (443 if url.scheme == "https" else 80))
+    bound = resolve_source(source)
+    session = make_session(source)
+
+    pings = []
+    for _ in range(PING_SAMPLES):
+        started = time.perf_counter()
+        session.get(f"{base}/latency.txt", timeout=TIMEOUT).raise_for_status()
+        pings.append((time.perf_counter() - started) * 1000)
+    try:
+        ip_addr = session.get(f"{base}/whoami", timeout=TIMEOUT).json().get("ip", "unknown")
+    except (ValueError, OSError):
+        ip_addr = "unknown"
+
+    if mode == "latency":
+        download_mbps = upload_mbps = None
+        used = 0
+        latency = probe_idle(address, source=bound)
+    else:
+        if mode == "short":
+            seconds = min(seconds, SHORT_TEST_SECONDS)
+        (dl_bytes, dl_secs), (ul_bytes, ul_secs), latency = probe_during(
+            address,
+            lambda: _parallel(_download_stream, base, source, seconds, streams),
+            lambda: _parallel(_upload_stream, base, source, seconds, streams),
+            source=bound)
+        download_mbps = round(dl_bytes * 8 / dl_secs / 1_000_000, 2)
+        upload_mbps = round(ul_bytes * 8 / ul_secs / 1_000_000, 2)
+        used = dl_bytes + ul_bytes
+
+    return {
+        "download": download_mbps,
+        "upload": upload_mbps,
+        "ping": round(min(pings), 2),
+        "server": url.netloc,
+        "ip": ip_addr,
+        "test_mode": mode,
+        "bytes_used": used,
+        **latency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="محرك قياس HTTP مدمج مع ربط بواجهة/عنوان مصدر")
+    parser.add_argument("url", help="عنوان الخادم، مثل http://127.0.0.1:8099")
+    parser.add_argument("--source", help="واجهة الشبكة أو عنوان المصدر")
+    parser.add_argument("--mode", choices=("full", "short", "latency"), default="full")
+    parser.add_argument("--seconds", type=float, default=TEST_SECONDS)
+    parser.add_argument("--streams", type=int, default=STREAMS)
+    args = parser.parse_args()
+    print(json.dumps(measure_http(args.url, args.source, args.mode, args.seconds, args.streams),
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Form submission for normalised measurement records (see speed_logformat.py).
+
+The autorun scripts build their payloads from module-level constants for one
+school; the replay command and the async agent need the same wiring for
+arbitrary records. This module reuses the scripts' entry IDs and mapping tries
+and builds every payload variant from the record itself.
+"""
+
+import threading
+import time
+
+import submit_speed_and_send_autorun as experimental
+import submit_speed_and_send_official_autorun_v2 as official
+from speed_latency import latency_note
+from speed_budget import mode_note
+from speed_bind import bound_session
+
+HEADERS = {
+    "Content-Type": "application/x-www-form-urlencoded;charset=utf-8",
+    "User-Agent": "Mozilla/5.0",
+}
+
+
+class RateLimiter:
+    """Spaces POSTs at least 1/rate seconds apart across all worker threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._mutex = threading.Lock()
+
+    def acquire(self):
+        with self._mutex:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def notes_for(rec, mid, suffix=""):
+    text = (
+        f"تنزيل: {rec['download_mbps']} Mbps | "
+        f"رفع: {rec['upload_mbps']} Mbps | "
+        f"Ping: {rec['ping_ms']} ms | "
+        f"السيرفر: {rec['server']} | "
+        f"IP: {rec['ip']} | "
+        f"الجهاز: {rec['device']} | "
+        f"التاريخ/الوقت: {rec['timestamp']} | "
+        f"المعرف: {mid}"
+    )
+    if latency_note(rec):
+        text += " | " + latency_note(rec)
+    if mode_note(rec):
+        text += " | " + mode_note(rec)
+    return f"{text} | {suffix}" if suffix else text
+
+
+def experimental_variants(rec, mid, suffix=""):
+    ids = experimental.ENTRY_IDS
+    payload = {
+        ids["school_code"]: rec["school_code"],
+        ids["sector"]: rec["sector"],
+        ids["school_name"]: rec["school_name"],
+        ids["provider"]: rec["provider"],
+        ids["line_number"]: rec["line_number"],
+        ids["service_type"]: rec["service_type"],
+        ids["internet_speed"]: f"{rec['download_mbps']} Mbps",
+        ids["notes"]: notes_for(rec, mid, suffix),
+    }
+    payload.update(experimental.HIDDEN_BASE)
+    yield payload
+    yield {k: v for k, v in payload.items() if k != "fbzx"}
+
+
+def official_variants(rec, mid, suffix=""):
+    text_ids = official.ENTRY_TEXT_IDS
+    for mapping in official.TEXT_MAPPING_TRIES:
+        for hidden in official.HIDDEN_CANDIDATES:
+            payload = {
+                text_ids["Q1_school_code"]: rec["school_code"],
+                official.ENTRY_SECTOR_ID: rec["sector"],
+                official.ENTRY_PROVIDER_ID: rec["provider"],
+                official.ENTRY_SERVICE_TYPE_ID: rec["service_type"],
+                text_ids[mapping["Q3_school_name"]]: rec["school_name"],
+                text_ids[mapping["Q5_line_number"]]: rec["line_number"],
+                text_ids[mapping["Q7_internet_speed"]]: f"{rec['download_mbps']} Mbps",
+                text_ids[mapping["Q8_notes"]]: notes_for(rec, mid, suffix),
+            }
+            payload.update(official.HIDDEN_ALWAYS)
+            payload.update(hidden)
+            yield payload
+
+
+FORMS = {
+    "official": (official.FORM_ACTION_URL, official_variants),
+    "experimental": (experimental.FORM_ACTION_URL, experimental_variants),
+}
+
+
+def submit_record(rec, mid, dedup, form="official", limiter=None, suffix="", timeout=30):
+    """Submit one record, trying each payload variant; returns (status_text, http_code).
+
+    The dedup index is checked before every POST and updated on acknowledgement.
+    Records measured on a bound line (rec["source"]) are submitted over that line too.
+    Latency-only records have no throughput to report and are never submitted.
+    """
+    import requests
+    if rec.get("download_mbps") is None:
+        return "NOT_SUBMITTED(latency)", None
+    url, variants = FORMS[form]
+    headers = dict(HEADERS, Referer=url.replace("/u/2/", "/").replace("formResponse", "viewform"))
+    code = None
+    session = bound_session(rec.get("source")) or requests
+    for payload in variants(rec, mid, suffix):
+        if dedup.seen(url, mid):
+            return "DUPLICATE", code
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            r = session.post(url, data=payload, headers=headers, timeout=timeout, allow_redirects=False)
+        except requests.RequestException:
+            continue
+        code = r.status_code
+        if code in (200, 302):
+            dedup.mark(url, mid, code)
+            return "SUCCESS", code
+    return f"FAIL({code})", code
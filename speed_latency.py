@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Latency under load (bufferbloat) and jitter, measured alongside the speed test.
+
+speedtest-cli's `ping` is taken on an idle line. A background thread here
+times TCP handshakes to the test server every PROBE_INTERVAL seconds while
+the line is idle, then during the download and during the upload. From
+those samples the record gets:
+
+    latency_idle_ms                         median handshake time before the test
+    latency_dl_p50_ms / latency_dl_p90_ms   while downloading
+    latency_ul_p50_ms / latency_ul_p90_ms   while uploading
+    jitter_ms                               mean change between consecutive loaded samples
+    probe_loss_pct                          probes that timed out or failed
+
+A TCP handshake needs no raw-socket privileges and queues behind the test
+traffic like any other packet, so loaded-minus-idle is the queueing delay
+users feel. For the Ookla CLI fallback the same fields come from its own
+loaded-latency JSON (from_ookla).
+"""
+
+import time
+import socket
+import threading
+
+PROBE_INTERVAL = 0.2   # seconds between probes
+PROBE_TIMEOUT = 2.0    # a probe slower than this counts as lost
+IDLE_SECONDS = 1.0     # idle baseline before the download starts
+
+LATENCY_FIELDS = (
+    "latency_idle_ms", "latency_dl_p50_ms", "latency_dl_p90_ms",
+    "latency_ul_p50_ms", "latency_ul_p90_ms", "jitter_ms", "probe_loss_pct",
+)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * (len(values) - 1) + 0.5))], 1)
+
+
+class LatencyProbe(threading.Thread):
+    """Times TCP connects to (host, port) until stop(); samples are tagged with the current phase."""
+
+    def __init__(self, host, port, interval=PROBE_INTERVAL, timeout=PROBE_TIMEOUT, source=None):
+        super().__init__(name="latency-probe", daemon=True)
+        family, _, _, _, self.sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+        self.family = family
+        self.source = source    # local address to probe from (see speed_bind.py)
+        self.interval = interval
+        self.timeout = timeout
+        self.phase = "idle"     # set to None between phases to pause recording
+        self.samples = []       # (phase, rtt_ms or None if lost)
+        self._stop_event = threading.Event()
+
+    def _probe(self):
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        started = time.perf_counter()
+        try:
+            if self.source:
+                sock.bind((self.source, 0))
+            sock.connect(self.sockaddr)
+            return (time.perf_counter() - started) * 1000
+        except OSError:
+            return None
+        finally:
+            sock.close()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            phase = self.phase
+            rtt = self._probe()
+            if phase is not None and phase == self.phase:
+                self.samples.append((phase, rtt))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(self.timeout + self.interval)
+
+    def summary(self):
+        by_phase = {"idle": [], "download": [], "upload": []}
+        lost = 0
+        for phase, rtt in self.samples:
+            if rtt is None:
+                lost += 1
+            else:
+                by_phase[phase].append(rtt)
+        diffs = []
+        for phase in ("download", "upload"):
+            rtts = by_phase[phase]
+            diffs += [abs(b - a) for a, b in zip(rtts, rtts[1:])]
+        total = len(self.samples)
+        return {
+            "latency_idle_ms": _percentile(by_phase["idle"], 0.5),
+            "latency_dl_p50_ms": _percentile(by_phase["download"], 0.5),
+            "latency_dl_p90_ms": _percentile(by_phase["download"], 0.9),
+            "latency_ul_p50_ms": _percentile(by_phase["upload"], 0.5),
+            "latency_ul_p90_ms": _percentile(by_phase["upload"], 0.9),
+            "jitter_ms": round(sum(diffs) / len(diffs), 1) if diffs else None,
+            "probe_loss_pct": round(100.0 * lost / total, 1) if total else None,
+        }
+
+
+def server_address(server):
+    """(host, port) of a speedtest-cli server dict ("host": "name:8080")."""
+    host, _, port = server.get("host", "").rpartition(":")
+    return (host, int(port)) if host and port.isdigit() else (server.get("host", ""), 8080)
+
+
+def probe_during(address, download, upload, source=None):
+    """Call download() then upload() with probes to `address` alongside.
+
+    Returns (download_result, upload_result, latency). If the server cannot be
+    probed the test still runs and the latency fields are None.
+    """
+    try:
+        probe = LatencyProbe(*address, source=source)
+        probe.start()
+        time.sleep(IDLE_SECONDS)
+    except (OSError, ValueError) as e:
+        print(f"[latency] تعذر بدء قياس التأخير تحت الحمل: {e}")
+        probe = None
+    try:
+        if probe:
+            probe.phase = "download"
+        download_result = download()
+        if probe:
+            probe.phase = None
+        time.sleep(0.5)
+        if probe:
+            probe.phase = "upload"
+        upload_result = upload()
+    finally:
+        if probe:
+            probe.stop()
+    latency = probe.summary() if probe else dict.fromkeys(LATENCY_FIELDS)
+    return download_result, upload_result, latency
+
+
+def run_loaded(st, pre_allocate=True, source=None):
+    """speedtest-cli download/upload under probes; `st` has its best server chosen already."""
+    return probe_during(server_address(st.results.server), st.download,
+                        lambda: st.upload(pre_allocate=pre_allocate), source)
+
+
+def probe_idle(address, seconds=2.0, source=None):
+    """Latency-only run: a few idle probes to the server, no throughput test."""
+    try:
+        probe = LatencyProbe(*address, source=source)
+    except (OSError, ValueError) as e:
+        print(f"[latency] تعذر قياس التأخير: {e}")
+        return dict.fromkeys(LATENCY_FIELDS)
+    probe.start()
+    time.sleep(seconds)
+    probe.stop()
+    return probe.summary()
+
+
+def from_ookla(data):
+    """Latency fields from Ookla CLI JSON; its loaded "iqm"/"high" stand in for p50/p90."""
+    def pick(section, key):
+        value = ((data.get(section) or {}).get("latency") or {}).get(key)
+        return round(float(value), 1) if value is not None else None
+
+    jitters = [j for j in (pick("download", "jitter"), pick("upload", "jitter")) if j is not None]
+    ping = data.get("ping") or {}
+    loss = data.get("packetLoss")
+    return {
+        "latency_idle_ms": round(float(ping["latency"]), 1) if ping.get("latency") is not None else None,
+        "latency_dl_p50_ms": pick("download", "iqm"),
+        "latency_dl_p90_ms": pick("download", "high"),
+        "latency_ul_p50_ms": pick("upload", "iqm"),
+        "latency_ul_p90_ms": pick("upload", "high"),
+        "jitter_ms": round(sum(jitters) / len(jitters), 1) if jitters else None,
+        "probe_loss_pct": round(float(loss), 1) if loss is not None else None,
+    }
+
+
+def latency_note(rec):
+    """One-line summary for the form notes field, or "" when there is no loaded-latency data."""
+    dl, ul = rec.get("latency_dl_p50_ms"), rec.get("latency_ul_p50_ms")
+    if dl is None and ul is None:
+        return ""
+    return (f"تأخير تحت الحمل تنزيل/رفع p50: {dl}/{ul} ms، p90: "
+            f"{rec.get('latency_dl_p90_ms')}/{rec.get('latency_ul_p90_ms')} ms "
+            f"(خامل {rec.get('latency_idle_ms')} ms) | "
+            f"تذبذب: {rec.get('jitter_ms')} ms | فقد: {rec.get('probe_loss_pct')}%")
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+One measuring device per line and slot.
+
+Several PCs in a school may run the autorun script (each with its own
+DEVICE_NAME). Without coordination they all start at 07:00, share the line
+and measure each other's traffic. Before measuring, each device now takes a
+lease for (school, line, day, slot label); only the holder runs the speed test
+and submits. The others either skip the slot or, with follower mode
+"latency", run only the idle latency probes and log the row locally with
+submit_status LEASE(<holder>) (never submitted; speed_replay.py ignores it, and
+as the line was loaded by the holder the statistics skip it too, see
+speed_logformat.stat_value()). A finished lease is never held again, not even
+by the device that finished it (e.g. its autorun restarted later in the slot):
+acquire() returns it as not held and the callers skip the slot.
+
+The lease lives in either
+    - a shared directory (\\\\SERVER\\speedtest\\leases, a mapped drive, NFS):
+      one small JSON file per lease, created with O_CREAT|O_EXCL so exactly one
+      device wins; or
+    - a relay on any PC in the school (`python speed_lease.py serve`), given
+      as its URL (http://10.0.0.5:8098); the relay keeps the same files locally.
+
+Keys name the slot, not the time, so devices whose clocks differ by a few
+minutes still contend for the same lease. A holder that crashes mid-run
+stops blocking the slot after LEASE_TTL_SECONDS: a device catching up later
+(e.g. after waking from sleep) takes the lease over. If the directory or relay
+cannot be reached, claim() fails open and the device measures anyway (a
+duplicate reading beats a missing one).
+
+Usage:
+    python speed_lease.py serve --dir leases --port 8098
+    python speed_lease.py show --lease leases           # or --lease http://10.0.0.5:8098
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LEASE_TTL_SECONDS = 15 * 60   # a full test with retries and CLI fallback stays well within this
+KEEP_DAYS = 7                 # lease files older than this are pruned
+FOLLOWER_MODES = ("skip", "latency")
+TIMEOUT = 10
+# <school>_<line>_<YYYY-MM-DD>_<label>.json, plus the .stale/.tmp files made from it
+LEASE_NAME = re.compile(r"^[^_]+_[^_]+_\d{4}-\d{2}-\d{2}_[^.]+\.json(\..+\.(stale|tmp))?$")
+
+
+def slot_key(school_code, line_number, label, day=None):
+    day = day or date.today()
+    return f"{school_code}_{line_number}_{day.isoformat()}_{label}".replace(":", "").replace(os.sep, "_")
+
+
+class FileLease:
+    """Leases as files in a (shared) directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def _read(self, path):
+        return self._read_raw(path)[1]
+
+    def _read_raw(self, path):
+        """(file bytes, lease) so a takeover can check it moved the lease it judged."""
+        with open(path, "rb") as f:
+            raw = f.read()
+        try:
+            return raw, json.loads(raw.decode("utf-8"))
+        except ValueError:
+            # the winner has created the file but not written it yet
+            return raw, {"device": "?", "acquired": os.path.getmtime(path),
+                         "expires": os.path.getmtime(path) + LEASE_TTL_SECONDS}
+
+    def _write(self, path, info):
+        tmp = f"{path}.{info['device']}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def acquire(self, key, device, ttl=LEASE_TTL_SECONDS):
+        """(True, lease) if `device` holds the lease now, else (False, current holder's lease)."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        for _ in range(3):
+            now = time.time()
+            info = {"key": key, "device": device, "acquired": now, "expires": now + ttl}
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    raw, held = self._read_raw(path)
+                except FileNotFoundError:
+                    continue  # taken over and not yet re-created; try again
+                if held.get("finished"):
+                    return False, held  # slot done (by any device, this one included)
+                if held["device"] == device:
+                    return True, held
+                if held["expires"] > now:
+                    return False, held
+                # expired without finishing: move it aside; only one device's rename succeeds
+                stale = f"{path}.{device}.stale"
+                try:
+                    os.rename(path, stale)
+                except FileNotFoundError:
+                    continue
+                self._restore_if_fresh(path, stale, raw)
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(info, f, ensure_ascii=False)
+            self.prune()
+            return True, info
+        held = self._read(path)
+        return held["device"] == device and not held.get("finished"), held
+
+    def _restore_if_fresh(self, path, stale, judged):
+        """Undo a takeover that moved another device's new lease instead of the expired one.
+
+        Between our read and our rename, another device may have taken the
+        expired lease over and created a fresh one; put that back (unless yet
+        another lease exists by now) so its holder keeps it.
+        """
+        try:
+            with open(stale, "rb") as f:
+                moved = f.read()
+        except FileNotFoundError:
+            return
+        if moved != judged:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                pass
+            else:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(moved)
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+    def release(self, key, device, status=None):
+        """Mark the slot done (status given) or give the lease up so another device may measure."""
+        path = self._path(key)
+        try:
+            held = self._read(path)
+        except FileNotFoundError:
+            return
+        if held["device"] != device:
+            return
+        if status is None:
+            os.remove(path)
+        else:
+            held.update(finished=time.time(), status=status)
+            self._write(path, held)
+
+    def leases(self):
+        if not os.path.isdir(self.directory):
+            return []
+        out = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                try:
+                    out.append(self._read(os.path.join(self.directory, name)))
+                except FileNotFoundError:
+                    pass
+        return out
+
+    def prune(self, keep_days=KEEP_DAYS):
+        """Remove old lease files; anything else in the (shared) directory is left alone."""
+        cutoff = time.time() - keep_days * 86400
+        for name in os.listdir(self.directory):
+            if not LEASE_NAME.match(name):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class RelayLease:
+    """Leases held by a relay (`speed_lease.py serve`) on another PC."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def _post(self, path, body):
+        import requests
+        r = requests.post(f"{self.url}{path}", json=body, timeout=TIMEOUT)
+        r.raise_for_status()
+        return r.json()
+
+    def acquire(self, key, device, ttl=LEASE_TTL_SECONDS):
+        reply = self._post("/acquire", {"key": key, "device": device, "ttl": ttl})
+        return reply["held"], reply["lease"]
+
+    def release(self, key, device, status=None):
+        self._post("/release", {"key": key, "device": device, "status": status})
+
+    def leases(self):
+        import requests
+        r = requests.get(f"{self.url}/leases", timeout=TIMEOUT)
+        r.raise_for_status()
+        return r.json()
+
+
+def open_lease(spec):
+    """FileLease / RelayLease for a LEASE_DIR setting, or None when coordination is off."""
+    if not spec:
+        return None
+    if spec.startswith(("http://", "https://")):
+        return RelayLease(spec)
+    return FileLease(spec)
+
+
+def claim(lease, key, device, ttl=LEASE_TTL_SECONDS):
+    """acquire() that fails open: an unreachable directory/relay means "measure anyway"."""
+    try:
+        return lease.acquire(key, device, ttl)
+    except (OSError, ValueError, KeyError) as e:  # requests errors are OSErrors
+        print(f"تعذر الوصول إلى ملف التنسيق ({e})؛ سيتم القياس دون تنسيق.")
+        return True, None
+
+
+def give_back(lease, key, device, status=None):
+    """release() that never fails the run."""
+    try:
+        lease.release(key, device, status)
+    except (OSError, ValueError) as e:
+        print(f"تعذر تحديث ملف التنسيق: {e}")
+
+
+# ---- relay ----
+class RelayHandler(BaseHTTPRequestHandler):
+    store = None
+    mutex = threading.Lock()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _reply(self, obj, code=200):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/leases":
+            self.send_error(404)
+            return
+        with self.mutex:
+            self._reply(self.store.leases())
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            key, device = body["key"], body["device"]
+        except (ValueError, KeyError):
+            self._reply({"error": "expected JSON with key and device"}, 400)
+            return
+        with self.mutex:
+            if self.path == "/acquire":
+                held, info = self.store.acquire(key, device, float(body.get("ttl", LEASE_TTL_SECONDS)))
+                self._reply({"held": held, "lease": info})
+            elif self.path == "/release":
+                self.store.release(key, device, body.get("status"))
+                self._reply({"ok": True})
+            else:
+                self._reply({"error": "not found"}, 404)
+
+
+def serve(directory, host="0.0.0.0", port=8098):
+    RelayHandler.store = FileLease(directory)
+    return ThreadingHTTPServer((host, port), RelayHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="تنسيق القياس بين أجهزة المدرسة: جهاز واحد لكل خط في كل موعد")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("serve", help="تشغيل وسيط التنسيق على هذا الجهاز")
+    p.add_argument("--dir", default=os.path.join(os.getcwd(), "logs", "leases"))
+    p.add_argument("--host", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=8098)
+    p = sub.add_parser("show", help="عرض عقود القياس الحالية")
+    p.add_argument("--lease", required=True, help="مجلد مشترك أو عنوان الوسيط")
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+        server = serve(args.dir, args.host, args.port)
+        print(f"وسيط التنسيق يعمل على http://{args.host}:{args.port} (الملفات في {args.dir})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+    for info in open_lease(args.lease).leases():
+        state = f"انتهى: {info.get('status')}" if info.get("finished") else \
+            ("جارٍ" if info["expires"] > time.time() else "منتهي الصلاحية")
+        print(f"{info.get('key', '?')}: {info['device']} ({state})")
+
+
+if __name__ == "__main__":
+    main()
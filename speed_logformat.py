@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reader for logs/speed_log.csv in every column layout the scripts produce.
+
+All scripts append to the same logs/speed_log.csv, so one file can mix layouts
+(its header only reflects whichever script created it). Each row is therefore
+recognised by its column count, not by the header:
+
+    11  submit_speed_to_form.py                 (no school code/name, no status)
+    13  submit_speed_and_send_official.py       (no status)
+    15  submit_speed_and_send_autorun.py        (+ schedule_label, submit_status)
+    17  submit_speed_and_send_official_autorun_v2.py (+ used_mapping, used_hidden)
+
+Since loaded-latency measurement (speed_latency.py) each script appends the
+LATENCY_FIELDS columns to its layout, giving 18/20/22/24 columns; those rows
+parse to the same layout names. Since the data-budget test modes
+(speed_budget.py) the v2 script and the agent also append RUN_FIELDS
+(test_mode, bytes_used, then source - the line the row was measured and is to
+be submitted over, speed_bind.py): 26/27 columns, still "autorun_v2". Older
+rows parse with an empty test_mode (counted as full tests) and source (the
+default route).
+
+Not every row is a like-for-like reading, so the statistics consumers
+(speed_anomaly.py, speed_rollup.py and through it speed_dashboard.py) take
+metric values through stat_value(): download/upload only from full tests
+(short runs read lower by design, latency-only runs have none), and nothing
+from lease followers (submit_status LEASE(<holder>), speed_lease.py), whose
+ping and latency probes ran while the holder was saturating the same line.
+
+iter_log() streams the file from a byte offset and yields (next_offset, record),
+so callers can checkpoint their position and resume without re-reading history.
+
+The log is append-only: a later change of a row's submit_status (replay, form
+sink outcomes) is appended to logs/status_updates.csv keyed by measurement ID
+instead of rewriting the row, so the offsets held by the anomaly detector,
+rollups and dashboard stay valid. current_status() gives a row's latest status.
+Updates are keyed by row_id(), the measurement ID of the row exactly as logged
+(submit_speed_to_form.py rows have no school code, so replay submits them
+under a filled-in ID but records their status under this one).
+"""
+
+import os
+import csv
+from datetime import datetime
+
+from speed_dedup import measurement_id
+from speed_latency import LATENCY_FIELDS
+from speed_logwriter import get_writer
+
+STATUS_FILE = os.path.join(os.getcwd(), "logs", "status_updates.csv")
+STATUS_HEADER = ["updated_at", "measurement_id", "submit_status"]
+
+LAYOUTS = {
+    11: ("to_form", [
+        "timestamp", "download_mbps", "upload_mbps", "ping_ms",
+        "server", "sponsor", "ip", "sector", "provider",
+        "service_type", "line_number",
+    ]),
+    13: ("official", [
+        "timestamp", "download_mbps", "upload_mbps", "ping_ms",
+        "server", "ip", "device",
+        "school_code", "sector", "school_name",
+        "provider", "line_number", "service_type",
+    ]),
+    15: ("autorun", [
+        "timestamp", "download_mbps", "upload_mbps", "ping_ms",
+        "server", "ip", "device",
+        "school_code", "sector", "school_name",
+        "provider", "line_number", "service_type", "schedule_label", "submit_status",
+    ]),
+    17: ("autorun_v2", [
+        "timestamp", "download_mbps", "upload_mbps", "ping_ms",
+        "server", "ip", "device",
+        "school_code", "sector", "school_name",
+        "provider", "line_number", "service_type", "schedule_label", "submit_status",
+        "used_mapping", "used_hidden",
+    ]),
+}
+
+# Same layouts with the loaded-latency columns appended
+LAYOUTS.update({n + len(LATENCY_FIELDS): (name, fields + list(LATENCY_FIELDS))
+                for n, (name, fields) in list(LAYOUTS.items())})
+
+# v2 rows since the data-budget test modes (26 columns) and with the bound line (27)
+RUN_FIELDS = ("test_mode", "bytes_used", "source")
+for n in (2, 3):
+    LAYOUTS[24 + n] = ("autorun_v2", LAYOUTS[24][1] + list(RUN_FIELDS[:n]))
+
+# Which Google Form each layout's script submits to
+LAYOUT_FORM = {"to_form": "official", "official": "official", "autorun": "experimental", "autorun_v2": "official"}
+
+NUMERIC_FIELDS = ("download_mbps", "upload_mbps", "ping_ms")
+THROUGHPUT_FIELDS = ("download_mbps", "upload_mbps")
+
+
+def _num(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_row(row):
+    """Map one CSV row to a normalised dict, or None for headers/unknown layouts."""
+    if not row or row[0] == "timestamp" or len(row) not in LAYOUTS:
+        return None
+    layout, fields = LAYOUTS[len(row)]
+    rec = dict(zip(fields, row))
+    rec["layout"] = layout
+    # to_form logs ISO timestamps ("2025-01-01T07:00:00"); the others use a space
+    rec["timestamp"] = rec["timestamp"].replace("T", " ")[:19]
+    for k in NUMERIC_FIELDS + LATENCY_FIELDS + ("bytes_used",):
+        rec[k] = _num(rec.get(k))
+    rec.setdefault("school_code", "")
+    rec.setdefault("school_name", "")
+    rec.setdefault("device", "")
+    rec.setdefault("schedule_label", "")
+    rec.setdefault("submit_status", "")
+    rec.setdefault("test_mode", "")
+    rec.setdefault("source", "")
+    return rec
+
+
+def stat_value(rec, metric):
+    """rec[metric] if this row may feed baselines/aggregates for that metric, else None."""
+    if rec["submit_status"].startswith("LEASE("):
+        return None
+    if metric in THROUGHPUT_FIELDS and rec["test_mode"] not in ("", "full"):
+        return None
+    return rec.get(metric)
+
+
+def record_status(mid, status, path=STATUS_FILE):
+    """Append a new submit_status for measurement `mid`."""
+    get_writer(path, STATUS_HEADER).write([datetime.now().isoformat(timespec="seconds"), mid, status])
+
+
+def load_status_updates(path=STATUS_FILE):
+    """{measurement_id: latest submit_status} from the status side file."""
+    updates = {}
+    if not os.path.exists(path):
+        return updates
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) == len(STATUS_HEADER) and row[0] != "updated_at":
+                updates[row[1]] = row[2]
+    return updates
+
+
+def row_id(rec):
+    """Key of a log row in the status side file (before any defaults are filled in)."""
+    return measurement_id(rec["school_code"], rec["line_number"], rec["timestamp"])
+
+
+def current_status(rec, updates):
+    """Latest submit_status of a log row, taking status updates into account."""
+    if updates:
+        return updates.get(row_id(rec), rec["submit_status"])
+    return rec["submit_status"]
+
+
+def school_key(rec):
+    """Stable per-school key; submit_speed_to_form.py rows only carry the line number."""
+    return rec["school_code"] or f"line:{rec['line_number']}"
+
+
+def iter_log(path, start=0, end=None):
+    """Yield (offset_after_row, record) for each complete data row in [start, end)."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for raw in f:
+            if end is not None and offset >= end:
+                break
+            if not raw.endswith(b"\n"):
+                break  # row still being written; pick it up next time
+            offset += len(raw)
+            line = raw.decode("utf-8-sig" if offset == len(raw) else "utf-8", errors="replace")
+            row = next(csv.reader([line]), None)
+            rec = parse_row(row)
+            if rec is not None:
+                yield offset, rec
+
+
+def resync_offset(path, offset):
+    """Make a saved offset safe to resume from.
+
+    Returns 0 if the file shrank (rotated/replaced); if the offset no longer
+    falls on a line boundary (e.g. the log was edited by hand), moves it
+    forward to the start of the next line.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 0
+    if offset <= 0 or offset > size:
+        return 0
+    with open(path, "rb") as f:
+        f.seek(offset - 1)
+        if f.read(1) == b"\n":
+            return offset
+        rest = f.readline()
+        return offset + len(rest)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrency-safe, buffered CSV log writer shared by all scripts.
+
+- Rows are buffered and appended in batches with a single write() per batch.
+- Each batch is written under an advisory lock on the log file (fcntl on
+  Linux/macOS, msvcrt on Windows), so several scripts/workers can append to
+  logs/speed_log.csv at once without interleaving rows.
+- The header is written under the same lock only when the file is empty, which
+  removes the check-then-create race of the old ensure_log_header().
+- fsync policy: every row (default), every N rows and/or every N seconds.
+- flush_interval / fsync_interval are enforced by a timer thread armed while
+  rows are buffered or unsynced, so a quiet log still reaches disk on time.
+
+Usage:
+    writer = get_writer(LOG_FILE, LOG_HEADER)
+    writer.write([...])            # or a dict / speed_record.Measurement
+    writer.flush()                 # also done automatically at normal interpreter exit
+
+Worker processes that end via os._exit (e.g. multiprocessing children) skip
+atexit, so they must call close() themselves when batch_size > 1.
+"""
+
+import io
+import os
+import csv
+import time
+import atexit
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            time.sleep(0.05)  # LK_LOCK gives up after ~10s; keep waiting
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class LogWriter:
+    """Buffered appender for one CSV file.
+
+    batch_size      rows kept in memory before they are written (1 = write immediately)
+    flush_interval  also write the buffer once it is this many seconds old
+    fsync_every     fsync after this many written rows (1 = every row, 0 = never)
+    fsync_interval  also fsync when this many seconds passed since the last fsync
+    """
+
+    def __init__(self, path, header, batch_size=1, flush_interval=None,
+                 fsync_every=1, fsync_interval=None):
+        self.path = str(path)
+        self.header = list(header)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._buf = []
+        self._buf_since = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._mutex = threading.Lock()
+        self._timer = None
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    def write(self, row):
+        if isinstance(row, dict):
+            row = [row.get(k, "") for k in self.header]
+        elif hasattr(row, "to_row"):  # speed_record.Measurement
+            row = row.to_row(self.header)
+        with self._mutex:
+            if not self._buf:
+                self._buf_since = time.monotonic()
+            self._buf.append(row)
+            if len(self._buf) >= self.batch_size or (
+                self.flush_interval is not None
+                and time.monotonic() - self._buf_since >= self.flush_interval
+            ):
+                self._flush_locked()
+            self._arm_locked()
+
+    def flush(self):
+        with self._mutex:
+            self._flush_locked()
+            self._arm_locked()
+
+    def _arm_locked(self):
+        """Start the timer for the next time-based flush/fsync, if one is pending."""
+        if self._timer is not None:
+            return
+        now = time.monotonic()
+        due = []
+        if self._buf and self.flush_interval is not None:
+            due.append(self._buf_since + self.flush_interval)
+        if self._unsynced and self.fsync_interval is not None:
+            due.append(self._last_sync + self.fsync_interval)
+        if not due:
+            return
+        self._timer = threading.Timer(max(0.0, min(due) - now), self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._mutex:
+            self._timer = None
+            now = time.monotonic()
+            if self._buf and self.flush_interval is not None and now - self._buf_since >= self.flush_interval:
+                self._flush_locked()
+            if self._unsynced and self.fsync_interval is not None and now - self._last_sync >= self.fsync_interval:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    os.fsync(f.fileno())
+                self._unsynced = 0
+                self._last_sync = now
+            self._arm_locked()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _flush_locked(self):
+        if not self._buf:
+            return
+        text = io.StringIO()
+        csv.writer(text).writerows(self._buf)
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            _lock(f)
+            try:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    header = io.StringIO()
+                    csv.writer(header).writerow(self.header)
+                    f.write(header.getvalue())
+                f.write(text.getvalue())
+                f.flush()
+                self._unsynced += len(self._buf)
+                if self._should_sync():
+                    os.fsync(f.fileno())
+                    self._unsynced = 0
+                    self._last_sync = time.monotonic()
+            finally:
+                _unlock(f)
+        self._buf = []
+        self._buf_since = None
+
+    def _should_sync(self):
+        if self.fsync_every and self._unsynced >= self.fsync_every:
+            return True
+        if self.fsync_interval is not None:
+            return time.monotonic() - self._last_sync >= self.fsync_interval
+        return False
+
+
+class locked_file:
+    """Open `path` with the same advisory lock the writers use (for in-place rewrites)."""
+
+    def __init__(self, path, mode="r+b"):
+        self.path = str(path)
+        self.mode = mode
+
+    def __enter__(self):
+        self.f = open(self.path, self.mode)
+        _lock(self.f)
+        return self.f
+
+    def __exit__(self, *exc):
+        try:
+            _unlock(self.f)
+        finally:
+            self.f.close()
+
+
+_writers = {}
+_writers_mutex = threading.Lock()
+
+
+def get_writer(path, header, **policy):
+    """One shared LogWriter per file per process (flock does not exclude threads of one process).
+
+    Later callers must ask for the same header, and any policy they pass must
+    match the shared writer's; otherwise ValueError (they would silently get
+    the first caller's columns or fsync/batch settings).
+    """
+    key = os.path.abspath(str(path))
+    with _writers_mutex:
+        w = _writers.get(key)
+        if w is None:
+            w = _writers[key] = LogWriter(path, header, **policy)
+            return w
+        clash = {k: getattr(w, k) for k, v in policy.items() if getattr(w, k) != v}
+        if list(header) != w.header or clash:
+            raise ValueError(f"{path} already has a writer with header {w.header} "
+                             f"and policy {clash or 'defaults'}; use the same header and policy")
+        return w
+
+
+@atexit.register
+def _flush_all():
+    for w in list(_writers.values()):
+        try:
+            w.flush()
+        except OSError:
+            pass
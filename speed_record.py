@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+One typed measurement record for all scripts, plus a columnar batch of them.
+
+Measurement replaces the ad-hoc result dicts ("download" vs "download_mbps",
+"ip" vs "client_ip") and the hand-built CSV row lists. It uses __slots__ (no
+per-instance dict) and still supports rec["field"] / rec.get(), so it can be
+passed anywhere a normalised log record (speed_logformat.parse_row) is used.
+
+MeasurementBatch stores many measurements column-wise:
+  - numeric columns in array("d") (NaN = missing), timestamps as epoch seconds
+    in array("q");
+  - text columns dictionary-encoded (array("I") codes + one list of distinct
+    values), since school/sector/provider/server repeat across rows.
+That is ~150 bytes per row, against ~1.6 KB for a parsed log-row dict.
+Columns can be handed to NumPy without copying (to_numpy()).
+
+Usage:
+    m = Measurement.from_results(results, school_code=..., schedule_label="07:00")
+    writer.write(m.to_row(LOG_HEADER))
+    batch = MeasurementBatch.from_log(LOG_FILE)
+    batch.column("download_mbps")         # array('d', ...)
+"""
+
+import math
+from array import array
+from datetime import datetime
+
+from speed_latency import LATENCY_FIELDS
+from speed_logformat import iter_log
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+NUMERIC = ("download_mbps", "upload_mbps", "ping_ms", "bytes_used") + LATENCY_FIELDS
+TEXT = ("server", "sponsor", "ip", "device", "school_code", "sector", "school_name", "provider",
+        "line_number", "service_type", "schedule_label", "submit_status", "used_mapping", "used_hidden",
+        "test_mode", "source")
+FIELDS = ("timestamp",) + NUMERIC + TEXT
+
+# Names used by the various scripts/log headers for the same field
+ALIASES = {"download": "download_mbps", "upload": "upload_mbps", "ping": "ping_ms", "client_ip": "ip"}
+
+
+class Measurement:
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for name in FIELDS:
+            setattr(self, name, None if name in NUMERIC else "")
+        self.update(**fields)
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            name = ALIASES.get(name, name)
+            if name in FIELDS:  # ignore unrelated keys (e.g. "layout", "form")
+                setattr(self, name, value)
+        return self
+
+    @classmethod
+    def from_results(cls, results, **meta):
+        """Build from a measure_speed() result dict of any script plus school/run metadata."""
+        m = cls(**results)
+        m.update(**meta)
+        if not m.timestamp:
+            m.timestamp = datetime.now().strftime(TS_FORMAT)
+        return m
+
+    @classmethod
+    def from_record(cls, rec):
+        return cls(**rec)
+
+    # dict-style access so existing record consumers keep working
+    def __getitem__(self, name):
+        return getattr(self, ALIASES.get(name, name))
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except AttributeError:
+            return default
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def to_row(self, header):
+        """Values in the order of a log header (any of the four scripts' layouts)."""
+        out = []
+        for name in header:
+            value = getattr(self, ALIASES.get(name, name), "")
+            out.append("" if value is None else value)
+        return out
+
+    def __repr__(self):
+        return (f"Measurement({self.timestamp} {self.school_code or self.line_number}: "
+                f"{self.download_mbps}/{self.upload_mbps} Mbps, {self.ping_ms} ms)")
+
+
+class _TextColumn:
+    """Dictionary-encoded string column."""
+
+    __slots__ = ("codes", "values", "index")
+
+    def __init__(self):
+        self.codes = array("I")
+        self.values = []
+        self.index = {}
+
+    def append(self, value):
+        value = "" if value is None else str(value)
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+
+class MeasurementBatch:
+    """Column-oriented container for many measurements."""
+
+    def __init__(self):
+        self.epoch = array("q")
+        self.numeric = {name: array("d") for name in NUMERIC}
+        self.text = {name: _TextColumn() for name in TEXT}
+
+    def __len__(self):
+        return len(self.epoch)
+
+    def append(self, rec):
+        ts = rec["timestamp"]
+        self.epoch.append(int(datetime.strptime(ts[:19].replace("T", " "), TS_FORMAT).timestamp()))
+        for name, col in self.numeric.items():
+            value = rec.get(name)
+            col.append(math.nan if value is None else float(value))
+        for name, col in self.text.items():
+            col.append(rec.get(name))
+
+    def extend(self, records):
+        for rec in records:
+            self.append(rec)
+        return self
+
+    @classmethod
+    def from_log(cls, path, start=0, end=None):
+        """Stream a log (any layout) straight into columns."""
+        return cls().extend(rec for _, rec in iter_log(path, start, end))
+
+    def __getitem__(self, i):
+        m = Measurement(timestamp=datetime.fromtimestamp(self.epoch[i]).strftime(TS_FORMAT))
+        for name, col in self.numeric.items():
+            value = col[i]
+            setattr(m, name, None if math.isnan(value) else value)
+        for name, col in self.text.items():
+            setattr(m, name, col[i])
+        return m
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, name):
+        """The backing array of a numeric column, or the epoch array for "timestamp"."""
+        if name == "timestamp":
+            return self.epoch
+        return self.numeric[ALIASES.get(name, name)]
+
+    def codes(self, name):
+        """(codes array, distinct values) of a text column, e.g. for group-by."""
+        col = self.text[name]
+        return col.codes, col.values
+
+    def rows(self, header):
+        """CSV rows in a log header's column order (for LogWriter / csv.writer)."""
+        for m in self:
+            yield m.to_row(header)
+
+    def to_numpy(self):
+        """Zero-copy NumPy views of the numeric/epoch columns and text codes (requires numpy)."""
+        try:
+            import numpy as np
+        except ImportError:
+            raise SystemExit("Missing dependency: numpy. Install via: pip install numpy")
+        out = {"timestamp": np.frombuffer(self.epoch, dtype=np.int64)}
+        for name, col in self.numeric.items():
+            out[name] = np.frombuffer(col, dtype=np.float64)
+        for name, col in self.text.items():
+            out[name] = np.frombuffer(col.codes, dtype=np.uint32)
+        return out
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registry of measurement backends and result sinks, imported on first use.
+
+Entries are "module:attribute" strings, so listing them (`speed_cli.py
+backends`, `speed_cli.py sinks`) or starting any non-measuring command imports
+neither speedtest nor requests; get_backend() / get_sink() import the module
+the first time a name is asked for.
+
+Built-in backends (each called as backend(mode=, source=, url=) and returning
+the measure_speed() result dict of the autorun scripts):
+
+    speedtest   speedtest-cli Python API (speedtest.net), with retries
+    ookla       Ookla speedtest CLI (speedtest / speedtest.exe on PATH)
+    engine      built-in HTTP engine (speed_engine.py) against `url`
+
+Built-in sinks are the sinks.json types of speed_sinks.py.
+
+More can be added without touching these files through speed_plugins.json
+in the working directory:
+
+    {"backends": {"lab": {"target": "my_lab:measure", "help": "..."}},
+     "sinks":    {"influx": {"target": "my_sinks:InfluxSink", "help": "..."}}}
+
+A plugin sink is a speed_sinks.Sink subclass taking its sinks.json options as
+keyword arguments, like the built-in ones.
+"""
+
+import os
+import json
+import importlib
+
+PLUGINS_FILE = os.path.join(os.getcwd(), "speed_plugins.json")
+
+BACKENDS = {
+    "speedtest": ("speed_registry:speedtest_api", "واجهة speedtest-cli البرمجية (speedtest.net)"),
+    "ookla": ("speed_registry:ookla_cli", "برنامج Ookla speedtest (سطر الأوامر)"),
+    "engine": ("speed_registry:http_engine", "المحرك المدمج (speed_engine.py) مع --url"),
+}
+
+SINKS = {
+    "form": ("speed_sinks:FormSink", "نموذج Google (official | experimental)"),
+    "csv": ("speed_sinks:CsvSink", "ملف CSV محلي"),
+    "jsonl": ("speed_sinks:JsonlSink", "ملف JSONL محلي"),
+    "webhook": ("speed_sinks:WebhookSink", "POST JSON إلى عنوان URL"),
+}
+
+_loaded = {}
+_plugins_read = False
+
+
+# ---- built-in backends (thin adapters so every backend has the same signature) ----
+def speedtest_api(mode="full", source=None, url=None):
+    import submit_speed_and_send_official_autorun_v2 as official
+    return official.measure_speed_python(mode=mode, source=source)
+
+
+def ookla_cli(mode="full", source=None, url=None):
+    import submit_speed_and_send_official_autorun_v2 as official
+    if mode != "full" or source:
+        raise ValueError("Ookla CLI backend only runs full, unbound tests")
+    return official.measure_speed_cli()
+
+
+def http_engine(mode="full", source=None, url=None):
+    from speed_engine import measure_http
+    if not url:
+        raise ValueError("engine backend needs a server url (e.g. http://127.0.0.1:8099)")
+    return measure_http(url, source, mode)
+
+
+# ---- lookup ----
+def read_plugins(path=PLUGINS_FILE):
+    """Merge speed_plugins.json into the registry (once)."""
+    global _plugins_read
+    if _plugins_read:
+        return
+    _plugins_read = True
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    for table, kind in ((BACKENDS, "backends"), (SINKS, "sinks")):
+        for name, entry in config.get(kind, {}).items():
+            table[name] = (entry["target"], entry.get("help", ""))
+
+
+def register_backend(name, target, help=""):
+    BACKENDS[name] = (target, help)
+
+
+def register_sink(name, target, help=""):
+    SINKS[name] = (target, help)
+
+
+def _resolve(table, kind, name):
+    read_plugins()
+    if name not in table:
+        raise ValueError(f"Unknown {kind} '{name}'. Allowed: {sorted(table)}")
+    target = table[name][0]
+    if target not in _loaded:
+        module, _, attr = target.partition(":")
+        _loaded[target] = getattr(importlib.import_module(module), attr)
+    return _loaded[target]
+
+
+def get_backend(name):
+    return _resolve(BACKENDS, "backend", name)
+
+
+def get_sink(name):
+    return _resolve(SINKS, "sink type", name)
+
+
+def names(table):
+    read_plugins()
+    return sorted(table)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay: re-submit measurements from logs/speed_log.csv that never reached the form.
+
+- Streams the log (all four column layouts, see speed_logformat.py).
+- Selects rows by status (default: FAIL(...) and QUEUED, i.e. rows handed to
+  the sinks of speed_sinks.py whose form delivery was dropped or interrupted),
+  date range, school and sector.
+- Re-submits concurrently with a global rate limit, to the form the original
+  script used (official or experimental).
+- Skips anything already in the dedup index (logs/submitted_ids.jsonl).
+- Acknowledged rows are checkpointed to logs/replay_checkpoint.json; an
+  interrupted run resumes where it stopped, and rows that failed again are
+  retried on the next run. Use --reset to start over.
+- New statuses are appended to logs/status_updates.csv (speed_logformat.py);
+  the log itself is never rewritten, so other tools' byte offsets stay valid.
+
+Usage:
+    python speed_replay.py --since 2025-01-01 --sector السيب
+    python speed_replay.py --status FAIL,UNKNOWN --workers 4 --rate 0.5
+    python speed_replay.py --dry-run
+"""
+
+import os
+import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from speed_dedup import DedupIndex, measurement_id
+from speed_forms import FORMS, RateLimiter, submit_record
+from speed_logformat import LAYOUT_FORM, STATUS_FILE, current_status, iter_log, load_status_updates, record_status, row_id
+
+LOG_DIR = os.path.join(os.getcwd(), "logs")
+LOG_FILE = os.path.join(LOG_DIR, "speed_log.csv")
+DEDUP_FILE = os.path.join(LOG_DIR, "submitted_ids.jsonl")
+CHECKPOINT_FILE = os.path.join(LOG_DIR, "replay_checkpoint.json")
+
+
+# -------- Checkpoint --------
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"results": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, ckpt):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(ckpt, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# -------- Selection --------
+def status_matches(status, wanted):
+    status = status or "UNKNOWN"
+    return any(status.startswith(w) for w in wanted)
+
+
+def select(rec, args, updates):
+    if not status_matches(current_status(rec, updates), args.status):
+        return False
+    day = rec["timestamp"][:10]
+    if args.since and day < args.since:
+        return False
+    if args.until and day > args.until:
+        return False
+    if args.school and args.school != rec["school_code"] and args.school not in rec["school_name"]:
+        return False
+    if args.sector and rec["sector"] != args.sector:
+        return False
+    return True
+
+
+def fill_defaults(rec, args):
+    # submit_speed_to_form.py rows carry no school code/name
+    rec["school_code"] = rec["school_code"] or args.school_code
+    rec["school_name"] = rec["school_name"] or args.school_name
+    rec["device"] = rec["device"] or "Device"
+    return rec
+
+
+def replay_one(rec, mid, dedup, limiter):
+    """Submit one logged measurement; returns the new status text."""
+    status, _ = submit_record(rec, mid, dedup, LAYOUT_FORM[rec["layout"]], limiter, suffix="إعادة إرسال")
+    return "SUCCESS(replay)" if status == "SUCCESS" else status
+
+
+# -------- Main --------
+def parse_args():
+    parser = argparse.ArgumentParser(description="إعادة إرسال القياسات التي لم تصل إلى النموذج")
+    parser.add_argument("--log", default=LOG_FILE)
+    parser.add_argument("--status", default="FAIL,QUEUED",
+                        help="بادئات الحالة المطلوبة مفصولة بفواصل؛ UNKNOWN للصفوف بلا عمود حالة")
+    parser.add_argument("--since", help="YYYY-MM-DD")
+    parser.add_argument("--until", help="YYYY-MM-DD")
+    parser.add_argument("--school", help="رمز المدرسة أو جزء من اسمها")
+    parser.add_argument("--sector")
+    parser.add_argument("--school-code", default="1561", help="للصفوف التي لا تحتوي رمز المدرسة")
+    parser.add_argument("--school-name", default="أبو القاسم الزهراوي للتعليم الأساسي 5-9")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=1.0, help="أقصى عدد طلبات POST في الثانية")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--reset", action="store_true", help="تجاهل نقطة الاستئناف السابقة")
+    parser.add_argument("--dry-run", action="store_true", help="عرض الصفوف المختارة فقط")
+    args = parser.parse_args()
+    args.status = [s.strip() for s in args.status.split(",") if s.strip()]
+    return args
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.log):
+        raise SystemExit(f"ملف السجل غير موجود: {args.log}")
+
+    ckpt = {"results": {}} if args.reset else load_checkpoint(args.checkpoint)
+    results = ckpt["results"]
+    dedup = DedupIndex(DEDUP_FILE)
+    limiter = RateLimiter(args.rate)
+    updates = load_status_updates()
+
+    selected = skipped = 0
+    outcome = {"ok": 0, "failed": 0}
+    in_flight = {}
+    lock = threading.Lock()
+
+    def finish(fut):
+        mid, key, rec = in_flight.pop(fut)
+        try:
+            status = fut.result()
+        except Exception as e:  # one bad row must not stop the replay or lose the others' results
+            status = f"FAIL({type(e).__name__})"
+        record_status(key, status)
+        with lock:
+            if status.startswith("FAIL"):
+                outcome["failed"] += 1  # not checkpointed: retried on the next run
+            else:
+                outcome["ok"] += 1
+                results[mid] = status
+                if len(results) % 20 == 0:
+                    save_checkpoint(args.checkpoint, ckpt)
+        print(f"- {rec['timestamp']} {rec['school_code']} [{mid}] => {status}")
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        try:
+            for _, rec in iter_log(args.log):
+                if not select(rec, args, updates):
+                    continue
+                key = row_id(rec)  # status updates follow the row as logged
+                rec = fill_defaults(rec, args)
+                mid = measurement_id(rec["school_code"], rec["line_number"], rec["timestamp"])
+                url = FORMS[LAYOUT_FORM[rec["layout"]]][0]
+                if mid in results or dedup.seen(url, mid):
+                    skipped += 1
+                    continue
+                selected += 1
+                if args.dry_run:
+                    print(f"- {rec['timestamp']} {rec['school_code']} {rec['layout']} [{mid}] {rec['submit_status'] or 'UNKNOWN'}")
+                    continue
+                # Bounded window: keep streaming without queueing the whole log
+                while len(in_flight) >= args.workers * 4:
+                    done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        finish(fut)
+                fut = pool.submit(replay_one, rec, mid, dedup, limiter)
+                in_flight[fut] = (mid, key, rec)
+            for fut in list(in_flight):
+                finish(fut)
+        finally:
+            save_checkpoint(args.checkpoint, ckpt)
+
+    print(f"\nالمختار: {selected} | المتخطى (مُرسل/معالج سابقًا): {skipped}")
+    if args.dry_run:
+        return
+    print(f"نجح: {outcome['ok']} | فشل: {outcome['failed']} (سيعاد في التشغيل القادم)")
+    print(f"الحالات الجديدة مسجلة في: {os.path.relpath(STATUS_FILE)}")
+
+
+if __name__ == "__main__":
+    main()
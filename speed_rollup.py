@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hourly and daily rollups of logs/speed_log.csv, kept in logs/rollups.sqlite.
+
+For every (granularity, dimension, key, bucket, metric) the table holds count,
+sum, min, max and a mergeable quantile sketch:
+
+    granularity  hour ("2025-01-31 07") | day ("2025-01-31")
+    dimension    school | sector | provider | service_type
+    metric       download_mbps | upload_mbps | ping_ms
+
+`update` reads only rows appended since the stored byte offset and merges
+them in one transaction (rollups + offset together, so a crash never counts a
+row twice). Queries over any period merge rollup rows only, never raw log rows.
+Only comparable readings are aggregated (speed_logformat.stat_value()).
+`rebuild` recomputes everything from the raw log, splitting it into line-aligned
+byte ranges processed by a process pool. Rollup rows do not record which log
+they came from, so a rebuild also resets the checkpoints of any other logs
+sharing the database; their next `update` re-reads them from the start.
+
+Usage:
+    python speed_rollup.py update
+    python speed_rollup.py query --dim school --key 1561 --since 2025-01-01 --until 2025-01-31
+    python speed_rollup.py query --dim sector --key السيب --metric ping_ms --gran hour
+    python speed_rollup.py rebuild --workers 4
+"""
+
+import os
+import json
+import math
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from speed_logformat import NUMERIC_FIELDS, iter_log, resync_offset, school_key, stat_value
+
+LOG_DIR = os.path.join(os.getcwd(), "logs")
+LOG_FILE = os.path.join(LOG_DIR, "speed_log.csv")
+DB_FILE = os.path.join(LOG_DIR, "rollups.sqlite")
+
+DIMENSIONS = ("school", "sector", "provider", "service_type")
+GRANULARITIES = {"hour": 13, "day": 10}  # timestamp prefix length per bucket
+
+SKETCH_ACCURACY = 0.01  # relative error of sketch quantiles
+
+
+class QuantileSketch:
+    """Log-bucketed histogram (DDSketch-style): quantiles within SKETCH_ACCURACY, merge = add counts."""
+
+    gamma = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+    log_gamma = math.log(gamma)
+
+    def __init__(self, bins=None, zeros=0):
+        self.bins = bins or {}
+        self.zeros = zeros
+
+    def add(self, x):
+        if x <= 0:
+            self.zeros += 1
+            return
+        i = math.ceil(math.log(x) / self.log_gamma)
+        self.bins[i] = self.bins.get(i, 0) + 1
+
+    def merge(self, other):
+        self.zeros += other.zeros
+        for i, c in other.bins.items():
+            self.bins[i] = self.bins.get(i, 0) + c
+        return self
+
+    def count(self):
+        return self.zeros + sum(self.bins.values())
+
+    def quantile(self, q):
+        n = self.count()
+        if n == 0:
+            return None
+        rank = q * (n - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for i in sorted(self.bins):
+            seen += self.bins[i]
+            if rank < seen:
+                return round(2 * self.gamma ** i / (self.gamma + 1), 2)
+        return round(2 * self.gamma ** max(self.bins) / (self.gamma + 1), 2)
+
+    def to_json(self):
+        return json.dumps({"z": self.zeros, "b": {str(k): v for k, v in self.bins.items()}})
+
+    @classmethod
+    def from_json(cls, text):
+        d = json.loads(text)
+        return cls({int(k): v for k, v in d["b"].items()}, d["z"])
+
+
+# -------- Aggregation (pure, used by update and by rebuild workers) --------
+def dim_values(rec):
+    return {"school": school_key(rec), "sector": rec["sector"],
+            "provider": rec["provider"], "service_type": rec["service_type"]}
+
+
+def add_record(agg, rec):
+    dims = dim_values(rec)
+    for gran, n in GRANULARITIES.items():
+        bucket = rec["timestamp"][:n]
+        for dim, key in dims.items():
+            for metric in NUMERIC_FIELDS:
+                x = stat_value(rec, metric)
+                if x is None:
+                    continue
+                k = (gran, dim, key, bucket, metric)
+                a = agg.get(k)
+                if a is None:
+                    agg[k] = a = [0, 0.0, x, x, QuantileSketch()]
+                a[0] += 1
+                a[1] += x
+                a[2] = min(a[2], x)
+                a[3] = max(a[3], x)
+                a[4].add(x)
+
+
+def merge_agg(into, other):
+    for k, b in other.items():
+        a = into.get(k)
+        if a is None:
+            into[k] = b
+            continue
+        a[0] += b[0]
+        a[1] += b[1]
+        a[2] = min(a[2], b[2])
+        a[3] = max(a[3], b[3])
+        a[4].merge(b[4])
+    return into
+
+
+def aggregate_range(path, start, end):
+    agg, rows, last = {}, 0, start
+    for last, rec in iter_log(path, start, end):
+        add_record(agg, rec)
+        rows += 1
+    return agg, rows, last
+
+
+# -------- Storage --------
+def connect(db_path=DB_FILE):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    con = sqlite3.connect(db_path)
+    con.execute("""CREATE TABLE IF NOT EXISTS rollup (
+        gran TEXT, dim TEXT, key TEXT, bucket TEXT, metric TEXT,
+        count INTEGER, sum REAL, min REAL, max REAL, sketch TEXT,
+        PRIMARY KEY (gran, dim, key, bucket, metric))""")
+    con.execute("CREATE TABLE IF NOT EXISTS checkpoint (log TEXT PRIMARY KEY, offset INTEGER)")
+    return con
+
+
+def get_offset(con, log_path):
+    row = con.execute("SELECT offset FROM checkpoint WHERE log = ?", (os.path.abspath(log_path),)).fetchone()
+    return row[0] if row else 0
+
+
+def store(con, agg, log_path, offset):
+    """Merge `agg` into the table and move the checkpoint, atomically."""
+    with con:
+        for k, (cnt, total, lo, hi, sketch) in agg.items():
+            row = con.execute(
+                "SELECT count, sum, min, max, sketch FROM rollup "
+                "WHERE gran=? AND dim=? AND key=? AND bucket=? AND metric=?", k).fetchone()
+            if row:
+                cnt += row[0]
+                total += row[1]
+                lo = min(lo, row[2])
+                hi = max(hi, row[3])
+                sketch = QuantileSketch.from_json(row[4]).merge(sketch)
+            con.execute("INSERT OR REPLACE INTO rollup VALUES (?,?,?,?,?,?,?,?,?,?)",
+                        (*k, cnt, total, lo, hi, sketch.to_json()))
+        con.execute("INSERT OR REPLACE INTO checkpoint VALUES (?, ?)", (os.path.abspath(log_path), offset))
+
+
+def update(log_path=LOG_FILE, db_path=DB_FILE):
+    """Fold rows appended since the last update into the rollups; returns rows processed."""
+    if not os.path.exists(log_path):
+        return 0
+    con = connect(db_path)
+    saved = get_offset(con, log_path)
+    start = resync_offset(log_path, saved)
+    if start == 0 and saved > 0:
+        con.close()
+        return rebuild(log_path, db_path)  # log was replaced; offsets are meaningless
+    agg, offset, rows = {}, start, 0
+    for offset, rec in iter_log(log_path, start):
+        add_record(agg, rec)
+        rows += 1
+    store(con, agg, log_path, offset)
+    con.close()
+    return rows
+
+
+def split_ranges(path, parts):
+    size = os.path.getsize(path)
+    cuts = [0] + [resync_offset(path, size * i // parts) for i in range(1, parts)] + [size]
+    cuts = sorted(set(cuts))
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def rebuild(log_path=LOG_FILE, db_path=DB_FILE, workers=None):
+    """Recompute all rollups from the raw log in parallel; returns rows processed.
+
+    The table is cleared for every log, so every checkpoint is reset with it.
+    """
+    if not os.path.exists(log_path):
+        return 0
+    workers = workers or os.cpu_count() or 1
+    ranges = split_ranges(log_path, workers)
+    agg, rows, end = {}, 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(aggregate_range, log_path, s, e) for s, e in ranges]
+        for fut in futures:
+            part, n, last = fut.result()
+            merge_agg(agg, part)
+            rows += n
+            end = max(end, last)  # a trailing partial row is left for the next update
+    con = connect(db_path)
+    with con:
+        con.execute("DELETE FROM rollup")
+        con.execute("DELETE FROM checkpoint")
+    store(con, agg, log_path, end)
+    con.close()
+    return rows
+
+
+def query(dim, key, since=None, until=None, metric="download_mbps", gran="day", db_path=DB_FILE,
+          quantiles=(0.5, 0.9, 0.99)):
+    """Merge rollups for one dimension key over [since, until] (bucket prefixes, inclusive)."""
+    sql = "SELECT count, sum, min, max, sketch FROM rollup WHERE gran=? AND dim=? AND key=? AND metric=?"
+    params = [gran, dim, key, metric]
+    if since:
+        sql += " AND bucket >= ?"
+        params.append(since[:GRANULARITIES[gran]])
+    if until:
+        # every finer bucket under the `until` prefix ("2025-01-31 23" for until="2025-01-31") is included
+        sql += " AND bucket <= ?"
+        params.append(until[:GRANULARITIES[gran]] + "\uffff")
+    con = connect(db_path)
+    cnt, total, lo, hi, sketch = 0, 0.0, None, None, QuantileSketch()
+    for c, s, mn, mx, sk in con.execute(sql, params):
+        cnt += c
+        total += s
+        lo = mn if lo is None else min(lo, mn)
+        hi = mx if hi is None else max(hi, mx)
+        sketch.merge(QuantileSketch.from_json(sk))
+    con.close()
+    out = {"count": cnt, "mean": round(total / cnt, 2) if cnt else None, "min": lo, "max": hi}
+    for q in quantiles:
+        out[f"p{round(q * 100):g}"] = sketch.quantile(q)
+    return out
+
+
+def series(dim, key, metric="download_mbps", gran="day", db_path=DB_FILE):
+    """[(bucket, count, mean, min, max)] for one key, oldest first (for charts)."""
+    con = connect(db_path)
+    rows = con.execute(
+        "SELECT bucket, count, sum, min, max FROM rollup WHERE gran=? AND dim=? AND key=? AND metric=? "
+        "ORDER BY bucket", (gran, dim, key, metric)).fetchall()
+    con.close()
+    return [(b, c, round(s / c, 2), mn, mx) for b, c, s, mn, mx in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="جداول تجميع ساعية ويومية لسجل السرعة")
+    parser.add_argument("--log", default=LOG_FILE)
+    parser.add_argument("--db", default=DB_FILE)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("update", help="إضافة الصفوف الجديدة فقط")
+    p_rebuild = sub.add_parser("rebuild", help="إعادة البناء من السجل الخام بالتوازي")
+    p_rebuild.add_argument("--workers", type=int)
+    p_query = sub.add_parser("query", help="إحصاءات فترة من جداول التجميع فقط")
+    p_query.add_argument("--dim", choices=DIMENSIONS, default="school")
+    p_query.add_argument("--key", required=True)
+    p_query.add_argument("--metric", choices=NUMERIC_FIELDS, default="download_mbps")
+    p_query.add_argument("--gran", choices=sorted(GRANULARITIES), default="day")
+    p_query.add_argument("--since")
+    p_query.add_argument("--until")
+    args = parser.parse_args()
+
+    if args.cmd == "update":
+        rows = update(args.log, args.db)
+        print(f"تمت إضافة {rows} صفًا إلى جداول التجميع: {args.db}")
+    elif args.cmd == "rebuild":
+        rows = rebuild(args.log, args.db, args.workers)
+        print(f"تمت إعادة البناء من {rows} صفًا: {args.db}")
+    else:
+        print(json.dumps(query(args.dim, args.key, args.since, args.until, args.metric, args.gran, args.db),
+                         ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
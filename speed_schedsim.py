@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulate loop_scheduler of an autorun script on a virtual clock.
+
+The real scheduler code runs unchanged; only the clock and the job are
+swapped (speed_clock.VirtualClock, and a job that records the call and
+"measures" for --job-minutes). Three months of 07:00/13:30 slots take well
+under a second.
+
+Each run is attributed to a slot of its label: the latest slot at or before
+the run's true time plus --early-window (so a run slightly early, e.g. after
+a forward clock jump, counts for the upcoming slot with negative lateness).
+The report lists runs per label, lateness percentiles, and the slots that
+were missed (no run) or duplicated (more than one run).
+
+Events file (JSON list; times in true/reference time):
+    [{"at": "2025-01-06 06:30", "type": "suspend", "minutes": 600},
+     {"at": "2025-02-01 03:00", "type": "jump", "minutes": -60}]
+
+Usage:
+    python speed_schedsim.py --days 90
+    python speed_schedsim.py --days 120 --events events.json --script autorun
+    python speed_schedsim.py --days 90 --random-suspends 40 --seed 7 --json
+"""
+
+import os
+import json
+import random
+import argparse
+import contextlib
+import importlib
+from datetime import datetime, timedelta
+
+from speed_clock import VirtualClock, SimulationEnd, parse_event, TS_FORMAT
+
+SCRIPTS = {
+    "official": "submit_speed_and_send_official_autorun_v2",
+    "autorun": "submit_speed_and_send_autorun",
+}
+LATE_MINUTES = 60       # runs later than this are listed as "late"
+SHOWN = 20              # missed/duplicate slots listed in the text report
+
+
+def random_suspends(start, end, count, seed):
+    """`count` suspends at random times, 10 minutes to 16 hours long (overnight sleep, lid closed...)."""
+    rnd = random.Random(seed)
+    span = (end - start).total_seconds()
+    return [{"at": start + timedelta(seconds=rnd.uniform(0, span)), "type": "suspend",
+             "minutes": rnd.randint(10, 16 * 60)} for _ in range(count)]
+
+
+def slot_for(label_time, t, early_window):
+    """The slot (datetime) a run at true time `t` belongs to."""
+    h, m = label_time
+    probe = t + early_window
+    slot = datetime.combine(probe.date(), datetime.min.time()).replace(hour=h, minute=m)
+    if slot > probe:
+        slot -= timedelta(days=1)
+    return slot
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * (len(values) - 1) + 0.5))]
+
+
+def simulate(script="official", start=None, days=90, events=(), job_minutes=1.5, early_window_minutes=120):
+    module = importlib.import_module(SCRIPTS[script])
+    start = start or datetime.combine(datetime.now().date(), datetime.min.time())
+    end = start + timedelta(days=days)
+    clock = VirtualClock(start, end, events)
+    runs = []
+
+    def job(label):
+        runs.append((label, clock.true, clock.now()))
+        clock.advance(job_minutes * 60)
+
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            module.loop_scheduler(clock=clock, job=job)
+        except SimulationEnd:
+            pass
+
+    times = {label: (h, m) for label, h, m in module.SCHEDULES}
+    early_window = timedelta(minutes=early_window_minutes)
+    expected = set()
+    day = start.date()
+    while day <= end.date():
+        for label, (h, m) in times.items():
+            slot = datetime.combine(day, datetime.min.time()).replace(hour=h, minute=m)
+            if start <= slot < end:
+                expected.add((label, slot))
+        day += timedelta(days=1)
+
+    per_slot, lateness = {}, {label: [] for label in times}
+    for label, true_t, _ in runs:
+        slot = slot_for(times[label], true_t, early_window)
+        per_slot.setdefault((label, slot), []).append(true_t)
+        lateness[label].append((true_t - slot).total_seconds() / 60)
+
+    def fmt(key):
+        return f"{key[1].strftime(TS_FORMAT)} [{key[0]}]"
+
+    report = {"script": script, "start": start.strftime(TS_FORMAT), "end": end.strftime(TS_FORMAT),
+              "events": len(events), "suspended_hours": round(clock.suspended.total_seconds() / 3600, 1),
+              "expected_slots": len(expected), "runs": len(runs), "labels": {}}
+    for label, lates in lateness.items():
+        quantiles = {"p50": percentile(lates, 0.5), "p90": percentile(lates, 0.9), "p99": percentile(lates, 0.99),
+                     "min": min(lates, default=None), "max": max(lates, default=None)}
+        report["labels"][label] = {
+            "runs": len(lates),
+            "lateness_min": {k: None if v is None else round(v, 1) for k, v in quantiles.items()},
+            "late": sum(1 for x in lates if x > LATE_MINUTES),
+            "early": sum(1 for x in lates if x < 0),
+        }
+    report["missed"] = [fmt(k) for k in sorted(expected - set(per_slot), key=lambda k: k[1])]
+    report["duplicates"] = [fmt(k) for k, v in sorted(per_slot.items(), key=lambda kv: kv[0][1]) if len(v) > 1]
+    return report
+
+
+def print_report(report):
+    print(f"المحاكاة ({report['script']}): {report['start']} → {report['end']} | "
+          f"أحداث: {report['events']} | ساعات السكون: {report['suspended_hours']}")
+    print(f"المواعيد المتوقعة: {report['expected_slots']} | مرات التشغيل: {report['runs']}")
+    for label, st in report["labels"].items():
+        lt = st["lateness_min"]
+        print(f"  [{label}] تشغيل={st['runs']} تأخير(دقائق) p50={lt['p50']} p90={lt['p90']} p99={lt['p99']} "
+              f"max={lt['max']} | متأخر>{LATE_MINUTES}د: {st['late']} | مبكر: {st['early']}")
+    for title, items in (("مواعيد فائتة", report["missed"]), ("مواعيد مكررة", report["duplicates"])):
+        print(f"{title}: {len(items)}")
+        for item in items[:SHOWN]:
+            print(f"  - {item}")
+        if len(items) > SHOWN:
+            print(f"  ... و{len(items) - SHOWN} أخرى")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="محاكاة جدولة التشغيل التلقائي بساعة افتراضية")
+    parser.add_argument("--script", choices=sorted(SCRIPTS), default="official")
+    parser.add_argument("--start", help="بداية المحاكاة YYYY-MM-DD HH:MM (افتراضيًا منتصف ليل اليوم)")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--events", help="ملف JSON بأحداث suspend/jump")
+    parser.add_argument("--random-suspends", type=int, default=0, help="عدد فترات سكون عشوائية إضافية")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--job-minutes", type=float, default=1.5, help="مدة القياس الواحد")
+    parser.add_argument("--early-window", type=int, default=120,
+                        help="التشغيل قبل الموعد بهذه الدقائق يُحسب للموعد القادم")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, TS_FORMAT) if args.start else None
+    events = []
+    if args.events:
+        with open(args.events, encoding="utf-8") as f:
+            events = [parse_event(ev) for ev in json.load(f)]
+    if args.random_suspends:
+        base = start or datetime.combine(datetime.now().date(), datetime.min.time())
+        events += random_suspends(base, base + timedelta(days=args.days), args.random_suspends, args.seed)
+
+    report = simulate(args.script, start, args.days, events, args.job_minutes, args.early_window)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fan-out result sinks: one measurement -> every configured destination, in parallel.
+
+Each sink owns a worker thread and a bounded queue, with its own timeout,
+retry count/backoff and overflow policy, so a slow sink (e.g. Google Forms)
+never delays the others or the next measurement. Dispatcher.dispatch() only
+enqueues and returns immediately.
+
+Sink types (sinks.json is a list of these objects; more can be registered
+through speed_plugins.json, see speed_registry.py):
+    {"type": "form", "form": "official" | "experimental"}
+    {"type": "csv",  "path": "logs/speed_log.csv"}          local store (v2 layout)
+    {"type": "jsonl", "path": "logs/results.jsonl"}
+    {"type": "webhook", "url": "https://...", "timeout": 5}
+Common options: timeout (s), retries, backoff (s), queue_size,
+overflow ("drop_oldest" | "drop_new").
+
+The CSV row is written with submit_status QUEUED when a form sink is
+configured (NOT_SUBMITTED otherwise). The form sink appends its final status
+to logs/status_updates.csv (speed_logformat.py), which replaces QUEUED for the
+tools; form outcomes also go to the dedup index and every sink's outcome to
+logs/sink_results.csv. Rows whose form delivery was dropped, failed or
+interrupted stay QUEUED/FAIL and can be re-sent with `speed_replay.py`, which
+skips IDs that did reach the form.
+"""
+
+import os
+import json
+import time
+import queue
+import threading
+from datetime import datetime
+
+import submit_speed_and_send_official_autorun_v2 as official
+from speed_forms import submit_record
+from speed_logformat import record_status
+from speed_logwriter import get_writer
+from speed_record import Measurement
+from speed_registry import get_sink
+
+LOG_DIR = os.path.join(os.getcwd(), "logs")
+SINKS_CONFIG_FILE = os.path.join(os.getcwd(), "sinks.json")
+RESULTS_FILE = os.path.join(LOG_DIR, "sink_results.csv")
+RESULTS_HEADER = ["logged_at", "measurement_id", "sink", "status", "attempts", "seconds"]
+
+
+class Sink:
+    """Base class: subclasses implement send(rec, mid) -> status text (raise/FAIL to retry)."""
+
+    def __init__(self, name, timeout=30, retries=2, backoff=5.0, queue_size=100, overflow="drop_oldest"):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.overflow = overflow
+        self.queue = queue.Queue(queue_size)
+        self.stats = {"sent": 0, "failed": 0, "dropped": 0}
+        self._stats_mutex = threading.Lock()  # counted from callers' threads and the worker
+        self.thread = threading.Thread(target=self._run, name=f"sink-{name}", daemon=True)
+        self.thread.start()
+
+    def send(self, rec, mid):
+        raise NotImplementedError
+
+    def put(self, rec, mid):
+        try:
+            self.queue.put_nowait((rec, mid))
+            return
+        except queue.Full:
+            pass
+        self._count("dropped")
+        if self.overflow == "drop_oldest":
+            try:
+                old, old_mid = self.queue.get_nowait()
+                self.queue.task_done()
+                self._record(old_mid, "DROPPED", 0, 0.0)
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait((rec, mid))
+            except queue.Full:
+                self._record(mid, "DROPPED", 0, 0.0)
+        else:
+            self._record(mid, "DROPPED", 0, 0.0)
+
+    def _run(self):
+        while True:
+            rec, mid = self.queue.get()
+            started = time.monotonic()
+            status, attempt = "FAIL", 0
+            for attempt in range(1, self.retries + 2):
+                try:
+                    status = self.send(rec, mid)
+                except Exception as e:
+                    status = f"FAIL({type(e).__name__})"
+                if not status.startswith("FAIL"):
+                    break
+                if attempt <= self.retries:
+                    time.sleep(self.backoff * attempt)
+            self._count("failed" if status.startswith("FAIL") else "sent")
+            self._record(mid, status, attempt, time.monotonic() - started)
+            self.queue.task_done()
+
+    def _count(self, key):
+        with self._stats_mutex:
+            self.stats[key] += 1
+
+    def snapshot(self):
+        with self._stats_mutex:
+            return dict(self.stats, queued=self.queue.qsize())
+
+    def _record(self, mid, status, attempts, seconds):
+        get_writer(RESULTS_FILE, RESULTS_HEADER).write([
+            datetime.now().isoformat(timespec="seconds"), mid, self.name, status, attempts, round(seconds, 2)])
+
+
+class FormSink(Sink):
+    def __init__(self, form="official", dedup=None, **opts):
+        super().__init__(f"form:{form}", **opts)
+        self.form = form
+        self.dedup = dedup
+
+    def send(self, rec, mid):
+        status, _ = submit_record(rec, mid, self.dedup, self.form, timeout=self.timeout)
+        return status
+
+    def _record(self, mid, status, attempts, seconds):
+        super()._record(mid, status, attempts, seconds)
+        if status != "DROPPED":  # dropped rows stay QUEUED for speed_replay.py
+            record_status(mid, status)
+
+
+class CsvSink(Sink):
+    def __init__(self, path=None, header=None, **opts):
+        super().__init__("csv", **opts)
+        self.path = path or official.LOG_FILE
+        self.header = header or official.LOG_HEADER
+        self.status = "QUEUED"  # build_sinks: NOT_SUBMITTED when no form sink is configured
+
+    def send(self, rec, mid):
+        row = Measurement(**rec.to_dict())
+        row.update(submit_status=rec.submit_status or self.status,
+                   used_mapping=rec.used_mapping or "None", used_hidden=rec.used_hidden or "None")
+        get_writer(self.path, self.header).write(row)
+        return "SUCCESS"
+
+
+class JsonlSink(Sink):
+    def __init__(self, path=None, **opts):
+        super().__init__("jsonl", **opts)
+        self.path = path or os.path.join(LOG_DIR, "results.jsonl")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    def send(self, rec, mid):
+        line = json.dumps(dict(rec.to_dict(), id=mid), ensure_ascii=False) + "\n"
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+        return "SUCCESS"
+
+
+class WebhookSink(Sink):
+    def __init__(self, url, **opts):
+        super().__init__(f"webhook:{url}", **opts)
+        self.url = url
+
+    def send(self, rec, mid):
+        import requests
+        r = requests.post(self.url, json=dict(rec.to_dict(), id=mid), timeout=self.timeout)
+        return "SUCCESS" if 200 <= r.status_code < 300 else f"FAIL({r.status_code})"
+
+
+class Dispatcher:
+    """Sends each measurement to every sink without waiting for any of them."""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def dispatch(self, rec, mid):
+        for sink in self.sinks:
+            sink.put(rec, mid)
+
+    def drain(self, timeout=None, names=None):
+        """Wait until all queued items are handled (or timeout); True if everything drained.
+
+        names: only wait for these sinks (e.g. ["csv"] before reading the log back).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for sink in self.sinks:
+            if names is not None and sink.name not in names:
+                continue
+            while sink.queue.unfinished_tasks:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.1)
+        return True
+
+    def stats(self):
+        return {s.name: s.snapshot() for s in self.sinks}
+
+
+def build_sinks(config, dedup):
+    sinks = []
+    for entry in config:
+        opts = dict(entry)
+        kind = opts.pop("type")
+        sink_class = get_sink(kind)
+        if kind == "form":
+            opts["dedup"] = dedup
+        sinks.append(sink_class(**opts))
+    if not any(isinstance(s, FormSink) for s in sinks):
+        for s in sinks:
+            if isinstance(s, CsvSink):
+                s.status = "NOT_SUBMITTED"
+    return Dispatcher(sinks)
+
+
+def load_dispatcher(dedup, path=SINKS_CONFIG_FILE):
+    """Dispatcher from sinks.json, or None when the file does not exist."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return build_sinks(json.load(f), dedup)
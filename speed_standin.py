@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for a speed test server, for the built-in engine (speed_engine.py).
+
+Endpoints:
+    GET  /latency.txt          tiny response for ping
+    GET  /whoami               {"ip": "<address the request came from>"}
+    GET  /download?bytes=N     N bytes of zeros
+    POST /upload               body is read and discarded
+    GET  /stats                {"<client ip>": {"requests": .., "down": .., "up": ..}}
+
+/whoami and /stats show which source address each request used, so binding
+can be checked without a second physical line. On Linux every 127.0.0.0/8
+address is local, so two "lines" can be simulated directly:
+
+    python speed_standin.py --port 8099
+    python speed_engine.py http://127.0.0.1:8099 --source 127.0.0.2
+    python speed_engine.py http://127.0.0.1:8099 --source 127.0.0.3
+    curl http://127.0.0.1:8099/stats
+
+(or add aliases to another interface: `ip addr add 10.9.0.2/24 dev lo`).
+"""
+
+import sys
+import json
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK = 64 * 1024
+MAX_DOWNLOAD = 1_000_000_000
+
+_stats = {}
+_stats_mutex = threading.Lock()
+
+
+def count(ip, down=0, up=0):
+    with _stats_mutex:
+        st = _stats.setdefault(ip, {"requests": 0, "down": 0, "up": 0})
+        st["requests"] += 1
+        st["down"] += down
+        st["up"] += up
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    verbose = False
+
+    def log_message(self, fmt, *args):
+        if self.verbose:
+            super().log_message(fmt, *args)
+
+    def _reply(self, body, ctype="text/plain"):
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        ip = self.client_address[0]
+        if url.path == "/latency.txt":
+            count(ip)
+            self._reply(b"test=test\n")
+        elif url.path == "/whoami":
+            count(ip)
+            self._reply(json.dumps({"ip": ip}).encode(), "application/json")
+        elif url.path == "/stats":
+            with _stats_mutex:
+                body = json.dumps(_stats, indent=2).encode()
+            self._reply(body, "application/json")
+        elif url.path == "/download":
+            size = min(int(parse_qs(url.query).get("bytes", ["1000000"])[0]), MAX_DOWNLOAD)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            zeros = bytes(CHUNK)
+            sent = 0
+            try:
+                while sent < size:
+                    n = min(CHUNK, size - sent)
+                    self.wfile.write(zeros[:n])
+                    sent += n
+            finally:
+                count(ip, down=sent)
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/upload":
+            self.send_error(404)
+            return
+        remaining = int(self.headers.get("Content-Length", 0))
+        received = 0
+        while remaining > 0:
+            data = self.rfile.read(min(CHUNK, remaining))
+            if not data:
+                break
+            received += len(data)
+            remaining -= len(data)
+        count(self.client_address[0], up=received)
+        self._reply(f"size={received}".encode())
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the engine drops connections mid-transfer when its test time is up
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(host="127.0.0.1", port=8099, verbose=False):
+    Handler.verbose = verbose
+    server = StandinServer((host, port), Handler)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="خادم قياس محلي بديل لاختبار المحرك المدمج وربط الواجهات")
+    parser.add_argument("--host", default="127.0.0.1", help="استخدم 0.0.0.0 للاستماع على كل العناوين")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    server = serve(args.host, args.port, args.verbose)
+    print(f"خادم القياس البديل يعمل على http://{args.host}:{args.port} (Ctrl+C للإيقاف)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
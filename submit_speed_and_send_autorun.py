@@ -13,10 +13,14 @@ Place a shortcut to this script (via python.exe) in the Windows Startup folder t
 """
 
 import os
-import csv
-import time
 from datetime import datetime, date, timedelta
-import requests
+
+from speed_dedup import DedupIndex, measurement_id
+from speed_logwriter import get_writer
+from speed_anomaly import AnomalyDetector, format_alert
+from speed_record import Measurement
+from speed_latency import LATENCY_FIELDS, latency_note, run_loaded
+from speed_clock import SystemClock
 
 # -------- User-configurable metadata (EDIT IF NEEDED) --------
 SCHOOL_CODE = "1561"                          # 1- رمز المدرسة
@@ -29,9 +33,19 @@ DEVICE_NAME = os.environ.get("COMPUTERNAME") or "Device"  # 7- اسم الجها
 
 # Scheduling (24h format, local time)
 SCHEDULES = [("07:00", 7, 0), ("13:30", 13, 30)]
+# Take an immediate extra measurement when this school's result looks degraded (optional)
+ANOMALY_FOLLOWUP = False
 
 LOG_DIR = os.path.join(os.getcwd(), "logs")
 LOG_FILE = os.path.join(LOG_DIR, "speed_log.csv")
+ANOMALY_STATE_FILE = os.path.join(LOG_DIR, "anomaly_state.json")
+DEDUP_FILE = os.path.join(LOG_DIR, "submitted_ids.jsonl")  # acknowledged submissions (survives restarts)
+LOG_HEADER = [
+    "timestamp", "download_mbps", "upload_mbps", "ping_ms",
+    "server", "ip", "device",
+    "school_code", "sector", "school_name",
+    "provider", "line_number", "service_type", "schedule_label", "submit_status"
+] + list(LATENCY_FIELDS)
 
 # -------- Google Form wiring (your EXPERIMENTAL form) --------
 FORM_ACTION_URL = "https://docs.google.com/forms/u/2/d/e/1FAIpQLSdZgyPaDsPtm-9B9dkKEwYhpEmedTC1QtC0BvpLH9pP3Saf2g/formResponse"
@@ -66,9 +80,9 @@ def measure_speed():
 
     s = speedtest.Speedtest()
     s.get_best_server()
-    download_mbps = round(s.download() / 1_000_000, 2)
-    time.sleep(0.5)
-    upload_mbps = round(s.upload(pre_allocate=False) / 1_000_000, 2)
+    download_bps, upload_bps, latency = run_loaded(s, pre_allocate=False)
+    download_mbps = round(download_bps / 1_000_000, 2)
+    upload_mbps = round(upload_bps / 1_000_000, 2)
     ping_ms = round(s.results.ping, 2)
 
     best = s.get_best_server()
@@ -81,26 +95,14 @@ def measure_speed():
         "ping": ping_ms,
         "server": server_host,
         "ip": ip_addr,
+        **latency,
     }
 
-def ensure_log_header(path):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    if not os.path.exists(path):
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                "timestamp", "download_mbps", "upload_mbps", "ping_ms",
-                "server", "ip", "device",
-                "school_code", "sector", "school_name",
-                "provider", "line_number", "service_type", "schedule_label", "submit_status"
-            ])
-
 def append_log(path, row):
-    with open(path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(row)
+    # Header creation + locked append are handled by the shared writer
+    get_writer(path, LOG_HEADER).write(row)
 
-def build_payload(results, timestamp):
+def build_payload(results, timestamp, mid):
     if SCHOOL_SECTOR not in ALLOWED_SECTORS:
         raise ValueError(f"Invalid sector '{SCHOOL_SECTOR}'. Allowed: {ALLOWED_SECTORS}")
     if SERVICE_PROVIDER not in ALLOWED_PROVIDERS:
@@ -115,8 +117,11 @@ def build_payload(results, timestamp):
         f"السيرفر: {results['server']} | "
         f"IP: {results['ip']} | "
         f"الجهاز: {DEVICE_NAME} | "
-        f"التاريخ/الوقت: {timestamp}"
+        f"التاريخ/الوقت: {timestamp} | "
+        f"المعرف: {mid}"
     )
+    if latency_note(results):
+        notes_text += " | " + latency_note(results)
 
     payload = {
         ENTRY_IDS["school_code"]: str(SCHOOL_CODE),
@@ -131,7 +136,8 @@ def build_payload(results, timestamp):
     payload.update(HIDDEN_BASE)
     return payload
 
-def submit_form(payload):
+def submit_form(payload, mid, dedup):
+    import requests
     headers = {
         "Content-Type": "application/x-www-form-urlencoded;charset=utf-8",
         "User-Agent": "Mozilla/5.0",
@@ -142,11 +148,17 @@ def submit_form(payload):
     last_code, last_preview = None, ""
 
     for variant in variants:
+        # Checked before every POST: another variant/process may already have landed it
+        if dedup.seen(FORM_ACTION_URL, mid):
+            return True, None, f"already submitted ({mid})"
         try:
-            resp = requests.post(FORM_ACTION_URL, data=variant, headers=headers, timeout=30)
+            # 302 is the acknowledgement; following it only risks a timeout after success
+            resp = requests.post(FORM_ACTION_URL, data=variant, headers=headers, timeout=30,
+                                 allow_redirects=False)
             last_code = resp.status_code
             last_preview = resp.text[:500]
             if resp.status_code in (200, 302):
+                dedup.mark(FORM_ACTION_URL, mid, resp.status_code)
                 return True, last_code, last_preview
         except Exception as e:
             last_preview = str(e)
@@ -164,17 +176,18 @@ def run_once(schedule_label):
           f"Ping {results['ping']} ms | "
           f"سيرفر {results['server']} | IP {results['ip']}")
 
-    ensure_log_header(LOG_FILE)
-
-    payload = build_payload(results, ts)
-    ok, code, preview = submit_form(payload)
-    status_txt = "SUCCESS" if ok else f"FAIL({code})"
-    append_log(LOG_FILE, [
-        ts, results["download"], results["upload"], results["ping"],
-        results["server"], results["ip"], DEVICE_NAME,
-        SCHOOL_CODE, SCHOOL_SECTOR, SCHOOL_NAME,
-        SERVICE_PROVIDER, LINE_NUMBER, SERVICE_TYPE, schedule_label, status_txt
-    ])
+    mid = measurement_id(SCHOOL_CODE, LINE_NUMBER, ts)
+    payload = build_payload(results, ts, mid)
+    ok, code, preview = submit_form(payload, mid, DedupIndex(DEDUP_FILE))
+    if ok and code is None:
+        status_txt = "DUPLICATE"
+    else:
+        status_txt = "SUCCESS" if ok else f"FAIL({code})"
+    append_log(LOG_FILE, Measurement.from_results(
+        results, timestamp=ts, device=DEVICE_NAME,
+        school_code=SCHOOL_CODE, sector=SCHOOL_SECTOR, school_name=SCHOOL_NAME,
+        provider=SERVICE_PROVIDER, line_number=LINE_NUMBER, service_type=SERVICE_TYPE,
+        schedule_label=schedule_label, submit_status=status_txt))
 
     if ok:
         print(f"[{schedule_label}] تم الإرسال بنجاح ✅ (HTTP {code})")
@@ -182,66 +195,87 @@ def run_once(schedule_label):
         print(f"[{schedule_label}] فشل الإرسال ❌ (HTTP {code})")
         print("Preview:", preview)
 
-def next_dt_for(hour, minute, today=None):
+def run_and_watch(schedule_label, detector):
+    """run_once + feed the new log row(s) to the anomaly detector; maybe follow up."""
+    run_once(schedule_label)
+    alerts = [a for a in detector.poll() if a["school"] == str(SCHOOL_CODE)]
+    for a in alerts:
+        print(format_alert(a))
+    if alerts and ANOMALY_FOLLOWUP:
+        print(f"[{schedule_label}] تم رصد تدهور؛ إجراء قياس متابعة فوري...")
+        run_once(f"{schedule_label}-followup")
+        for a in detector.poll():
+            if a["school"] == str(SCHOOL_CODE):
+                print(format_alert(a))
+
+def next_dt_for(hour, minute, today=None, now=None):
     if today is None:
         today = date.today()
     candidate = datetime.combine(today, datetime.min.time()).replace(hour=hour, minute=minute)
-    now = datetime.now()
+    if now is None:
+        now = datetime.now()
     if candidate <= now:
         candidate += timedelta(days=1)
     return candidate
 
-def loop_scheduler():
+def loop_scheduler(clock=None, job=None):
     print("سيعمل السكربت تلقائيًا مرتين يوميًا: 07:00 و 13:30.")
     print("اترك النافذة مفتوحة أو شغل السكربت ضمن الخلفية.")
 
+    clock = clock or SystemClock()
     # Track last run date for each label to avoid duplicates after sleep/wake
     last_run = {label: None for (label, _, _) in SCHEDULES}
+    if job is None:
+        detector = AnomalyDetector(ANOMALY_STATE_FILE, LOG_FILE)
+        job = lambda label: run_and_watch(label, detector)
 
     while True:
-        now = datetime.now()
+        now = clock.now()
         ran_any = False
 
         # Catch-up: if a scheduled time already passed today and not run yet, run it now
         for (label, h, m) in SCHEDULES:
-            sched_today = datetime.combine(date.today(), datetime.min.time()).replace(hour=h, minute=m)
-            if now >= sched_today and last_run[label] != date.today():
-                run_once(label)
-                last_run[label] = date.today()
+            sched_today = datetime.combine(clock.today(), datetime.min.time()).replace(hour=h, minute=m)
+            if now >= sched_today and last_run[label] != clock.today():
+                job(label)
+                last_run[label] = clock.today()
                 ran_any = True
 
         if ran_any:
             # After catch-up, short nap then continue
-            time.sleep(30)
+            clock.sleep(30)
             continue
 
         # Otherwise, sleep until the next scheduled event
         upcoming = []
         for (label, h, m) in SCHEDULES:
-            sched_today = datetime.combine(date.today(), datetime.min.time()).replace(hour=h, minute=m)
-            if last_run[label] == date.today():
+            sched_today = datetime.combine(clock.today(), datetime.min.time()).replace(hour=h, minute=m)
+            if last_run[label] == clock.today():
                 # already done today; consider tomorrow's occurrence
-                sched = next_dt_for(h, m, date.today())
+                sched = next_dt_for(h, m, clock.today() + timedelta(days=1), clock.now())
             else:
                 # not yet run today; if time passed, next_dt_for will pick tomorrow
-                sched = next_dt_for(h, m, date.today())
+                sched = next_dt_for(h, m, clock.today(), clock.now())
                 # If we're still before today's time and not run, choose today's
-                if datetime.now() < sched_today:
+                if clock.now() < sched_today:
                     sched = sched_today
             upcoming.append((sched, label))
 
         next_time, next_label = min(upcoming, key=lambda x: x[0])
-        wait_seconds = max(5, int((next_time - datetime.now()).total_seconds()))
+        wait_seconds = max(5, int((next_time - clock.now()).total_seconds()))
         # sleep in chunks to be responsive to system clock changes
         print(f"ينام حتى {next_time.strftime('%Y-%m-%d %H:%M')} للحدث [{next_label}] (~{wait_seconds//60} دقيقة).")
         while wait_seconds > 0:
             nap = min(wait_seconds, 300)  # sleep up to 5 minutes per chunk
-            time.sleep(nap)
-            wait_seconds = int((next_time - datetime.now()).total_seconds())
+            clock.sleep(nap)
+            wait_seconds = int((next_time - clock.now()).total_seconds())
 
+        if clock.today() != next_time.date():
+            # woke from suspend on a later day: that slot is gone, let catch-up handle today
+            continue
         # Time reached; run the job
-        run_once(next_label)
-        last_run[next_label] = date.today()
+        job(next_label)
+        last_run[next_label] = clock.today()
 
 def main():
     loop_scheduler()
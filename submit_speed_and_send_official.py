@@ -13,10 +13,12 @@ Run:
 """
 
 import os
-import csv
-import time
 from datetime import datetime
-import requests
+
+from speed_dedup import DedupIndex, measurement_id
+from speed_logwriter import get_writer
+from speed_record import Measurement
+from speed_latency import LATENCY_FIELDS, latency_note, run_loaded
 
 # -------- User-configurable metadata (PRE-FILLED) --------
 SCHOOL_CODE = "1561"                          # 1- رمز المدرسة
@@ -28,6 +30,13 @@ SERVICE_TYPE = "فايبر"                        # 6- نوع الخدمة: ف
 DEVICE_NAME = os.environ.get("COMPUTERNAME") or "Device"  # 7- اسم الجهاز (تلقائي)
 LOG_DIR = os.path.join(os.getcwd(), "logs")
 LOG_FILE = os.path.join(LOG_DIR, "speed_log.csv")
+DEDUP_FILE = os.path.join(LOG_DIR, "submitted_ids.jsonl")  # acknowledged submissions (survives restarts)
+LOG_HEADER = [
+    "timestamp", "download_mbps", "upload_mbps", "ping_ms",
+    "server", "ip", "device",
+    "school_code", "sector", "school_name",
+    "provider", "line_number", "service_type"
+] + list(LATENCY_FIELDS)
 
 # -------- OFFICIAL Google Form wiring (extracted from uploaded HTML) --------
 FORM_ACTION_URL = "https://docs.google.com/forms/u/2/d/e/1FAIpQLSfoYtl3gmt9FYa7g39v4az1OOtrkYHDcfAX6M-vhI6J-hX50A/formResponse"
@@ -77,9 +86,9 @@ def measure_speed():
 
     s = speedtest.Speedtest()
     s.get_best_server()
-    download_mbps = round(s.download() / 1_000_000, 2)
-    time.sleep(0.5)
-    upload_mbps = round(s.upload(pre_allocate=False) / 1_000_000, 2)
+    download_bps, upload_bps, latency = run_loaded(s, pre_allocate=False)
+    download_mbps = round(download_bps / 1_000_000, 2)
+    upload_mbps = round(upload_bps / 1_000_000, 2)
     ping_ms = round(s.results.ping, 2)
 
     best = s.get_best_server()
@@ -92,28 +101,14 @@ def measure_speed():
         "ping": ping_ms,
         "server": server_host,
         "ip": ip_addr,
+        **latency,
     }
 
-def ensure_log_header(path):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    if not os.path.exists(path):
-        import csv
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                "timestamp", "download_mbps", "upload_mbps", "ping_ms",
-                "server", "ip", "device",
-                "school_code", "sector", "school_name",
-                "provider", "line_number", "service_type"
-            ])
-
 def append_log(path, row):
-    import csv
-    with open(path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(row)
+    # Header creation + locked append are handled by the shared writer
+    get_writer(path, LOG_HEADER).write(row)
 
-def build_payload_base(results, ts):
+def build_payload_base(results, ts, mid):
     if SCHOOL_SECTOR not in ALLOWED_SECTORS:
         raise ValueError(f"Invalid sector '{SCHOOL_SECTOR}'. Allowed: {ALLOWED_SECTORS}")
     if SERVICE_PROVIDER not in ALLOWED_PROVIDERS:
@@ -128,8 +123,11 @@ def build_payload_base(results, ts):
         f"السيرفر: {results['server']} | "
         f"IP: {results['ip']} | "
         f"الجهاز: {DEVICE_NAME} | "
-        f"التاريخ/الوقت: {ts}"
+        f"التاريخ/الوقت: {ts} | "
+        f"المعرف: {mid}"
     )
+    if latency_note(results):
+        notes_text += " | " + latency_note(results)
 
     base = {
         ENTRY_TEXT_IDS["Q1_school_code"]: str(SCHOOL_CODE),
@@ -140,8 +138,9 @@ def build_payload_base(results, ts):
 
     return base, notes_text
 
-def try_submit_with_mapping(mapping, results, ts):
-    base, notes_text = build_payload_base(results, ts)
+def try_submit_with_mapping(mapping, results, ts, mid, dedup):
+    import requests
+    base, notes_text = build_payload_base(results, ts, mid)
 
     # Resolve mapping to actual entry.* keys
     q3_id = ENTRY_TEXT_IDS[mapping["Q3_school_name"]]
@@ -153,15 +152,7 @@ def try_submit_with_mapping(mapping, results, ts):
     payload[q3_id] = SCHOOL_NAME
     payload[q5_id] = str(LINE_NUMBER)
     payload[q7_id] = f"{results['download']} Mbps"   # field 7
-    payload[q8_id] = (
-        f"تنزيل: {results['download']} Mbps | "
-        f"رفع: {results['upload']} Mbps | "
-        f"Ping: {results['ping']} ms | "
-        f"السيرفر: {results['server']} | "
-        f"IP: {results['ip']} | "
-        f"الجهاز: {DEVICE_NAME} | "
-        f"التاريخ/الوقت: {ts}"
-    )
+    payload[q8_id] = notes_text
 
     # Try with and without fbzx (token varies)
     headers = {
@@ -172,12 +163,24 @@ def try_submit_with_mapping(mapping, results, ts):
 
     variants = [payload, dict(payload, **{"fbzx": "8122308104194036559"})]
 
+    code, preview = None, ""
     for variant in variants:
-        r = requests.post(FORM_ACTION_URL, data=variant, headers=headers, timeout=30)
+        # Checked before every POST: an earlier variant/run may already have landed it
+        if dedup.seen(FORM_ACTION_URL, mid):
+            return True, None, f"already submitted ({mid})", mapping
+        try:
+            # 302 is the acknowledgement; following it only risks a timeout after success
+            r = requests.post(FORM_ACTION_URL, data=variant, headers=headers, timeout=30,
+                              allow_redirects=False)
+        except requests.RequestException as e:
+            preview = str(e)
+            continue
+        code, preview = r.status_code, r.text[:500]
         if r.status_code in (200, 302):
-            return True, r.status_code, r.text[:500], mapping
+            dedup.mark(FORM_ACTION_URL, mid, r.status_code)
+            return True, code, preview, mapping
 
-    return False, r.status_code, r.text[:500], mapping
+    return False, code, preview, mapping
 
 def main():
     print("بدء قياس السرعة... قد يستغرق الأمر دقيقة.")
@@ -193,19 +196,18 @@ def main():
     print(f"IP العميل: {results['ip']}")
     print(f"الجهاز: {DEVICE_NAME}")
 
-    ensure_log_header(LOG_FILE)
-    append_log(LOG_FILE, [
-        ts, results["download"], results["upload"], results["ping"],
-        results["server"], results["ip"], DEVICE_NAME,
-        SCHOOL_CODE, SCHOOL_SECTOR, SCHOOL_NAME,
-        SERVICE_PROVIDER, LINE_NUMBER, SERVICE_TYPE
-    ])
+    append_log(LOG_FILE, Measurement.from_results(
+        results, timestamp=ts, device=DEVICE_NAME,
+        school_code=SCHOOL_CODE, sector=SCHOOL_SECTOR, school_name=SCHOOL_NAME,
+        provider=SERVICE_PROVIDER, line_number=LINE_NUMBER, service_type=SERVICE_TYPE))
     print(f"\nتم حفظ النتيجة محليًا في: {LOG_FILE}")
 
     print("\nجارٍ إرسال النتائج إلى النموذج الرسمي...")
+    mid = measurement_id(SCHOOL_CODE, LINE_NUMBER, ts)
+    dedup = DedupIndex(DEDUP_FILE)
     last_preview = ""
     for mapping in TEXT_MAPPING_TRIES:
-        ok, code, preview, used = try_submit_with_mapping(mapping, results, ts)
+        ok, code, preview, used = try_submit_with_mapping(mapping, results, ts, mid, dedup)
         print(f"- تجربة بالترتيب {used} => Status {code}")
         last_preview = preview
         if ok:
@@ -18,12 +18,20 @@ Usage:
 """
 
 import os
-import csv
 import time
 import json
 import subprocess
 from datetime import datetime, date, timedelta
-import requests
+
+from speed_dedup import DedupIndex, measurement_id
+from speed_logwriter import get_writer
+from speed_anomaly import AnomalyDetector, format_alert
+from speed_record import Measurement
+from speed_latency import LATENCY_FIELDS, from_ookla, latency_note, probe_idle, run_loaded, server_address
+from speed_bind import bound_session, resolve_source
+from speed_lease import claim, give_back, open_lease, slot_key
+from speed_budget import DataBudget, SHORT_TEST_SECONDS, is_metered, mode_note
+from speed_clock import SystemClock
 
 # -------- User-configurable metadata (PRE-FILLED) --------
 SCHOOL_CODE = "1561"                          # 1- رمز المدرسة
@@ -33,12 +41,30 @@ SERVICE_PROVIDER = "عمانتل"                   # 4- موفر الخدمة
 LINE_NUMBER = "24424428"                      # 5- رقم الخط
 SERVICE_TYPE = "فايبر"                        # 6- نوع الخدمة (أو 'الجيل الخامس 5 G')
 DEVICE_NAME = os.environ.get("COMPUTERNAME") or "Device"  # 7- اسم الجهاز (تلقائي)
+DATA_BUDGET_MB = 5000                         # باقة البيانات الشهرية بالميغابايت (لخطوط 5G فقط)
+SOURCE = ""          # واجهة الخط أو عنوان المصدر (مثل "eth1" أو "192.168.8.10")؛ فارغ = ما يختاره النظام
+ENGINE_URL = ""      # خادم للمحرك المدمج بدل speedtest.net (مثل http://127.0.0.1:8099 مع speed_standin.py)
+LEASE_DIR = ""       # مجلد مشترك أو عنوان وسيط التنسيق (speed_lease.py) عند تشغيل السكربت على عدة أجهزة
+LEASE_FOLLOWER = "latency"  # الأجهزة الأخرى في نفس الموعد: "skip" تتخطى، "latency" تقيس التأخير فقط دون إرسال
 
 # Scheduling (24h, local time)
 SCHEDULES = [("07:00", 7, 0), ("13:30", 13, 30)]
+# Take an immediate extra measurement when this school's result looks degraded (optional;
+# on 5G lines only when the data budget can spare more than a latency-only run)
+ANOMALY_FOLLOWUP = False
+CSV_SINK_WAIT = 30   # seconds to wait for the CSV sink (sinks.json) before reading the log back
 
 LOG_DIR = os.path.join(os.getcwd(), "logs")
 LOG_FILE = os.path.join(LOG_DIR, "speed_log.csv")
+ANOMALY_STATE_FILE = os.path.join(LOG_DIR, "anomaly_state.json")
+DEDUP_FILE = os.path.join(LOG_DIR, "submitted_ids.jsonl")  # acknowledged submissions (survives restarts)
+BUDGET_FILE = os.path.join(LOG_DIR, "data_budget.json")    # bytes used per metered line this month (may live in LEASE_DIR)
+LOG_HEADER = [
+    "timestamp", "download_mbps", "upload_mbps", "ping_ms",
+    "server", "ip", "device",
+    "school_code", "sector", "school_name",
+    "provider", "line_number", "service_type", "schedule_label", "submit_status", "used_mapping", "used_hidden"
+] + list(LATENCY_FIELDS) + ["test_mode", "bytes_used", "source"]
 
 # -------- OFFICIAL Google Form wiring --------
 FORM_ACTION_URL = "https://docs.google.com/forms/u/2/d/e/1FAIpQLSfoYtl3gmt9FYa7g39v4az1OOtrkYHDcfAX6M-vhI6J-hX50A/formResponse"
@@ -78,21 +104,30 @@ HIDDEN_CANDIDATES = [
 HIDDEN_ALWAYS = {"fvv": "1", "pageHistory": "0"}
 
 # -------- Speed measurement (robust) --------
-def measure_speed_python(max_attempts=3, backoff=20):
-    """Try Python API with secure=True; retry on 403 ConfigRetrievalError"""
+def measure_speed_python(max_attempts=3, backoff=20, mode="full", source=None):
+    """Try Python API with secure=True; retry on 403 ConfigRetrievalError.
+    mode: "full", "short" (shorter download/upload) or "latency" (no throughput test).
+    source: interface or local address every connection is bound to."""
     try:
         import speedtest  # from speedtest-cli
     except ImportError:
         raise SystemExit("Missing dependency: speedtest-cli. Install via: pip install speedtest-cli")
 
+    address = resolve_source(source)
     last_err = None
     for attempt in range(1, max_attempts + 1):
         try:
-            s = speedtest.Speedtest(secure=True)
+            s = speedtest.Speedtest(secure=True, source_address=address)
             s.get_best_server()
-            download_mbps = round(s.download() / 1_000_000, 2)
-            time.sleep(0.5)
-            upload_mbps = round(s.upload(pre_allocate=False) / 1_000_000, 2)
+            if mode == "latency":
+                latency = probe_idle(server_address(s.results.server), source=address)
+                download_mbps = upload_mbps = None
+            else:
+                if mode == "short":
+                    s.config["length"].update(download=SHORT_TEST_SECONDS, upload=SHORT_TEST_SECONDS)
+                download_bps, upload_bps, latency = run_loaded(s, pre_allocate=False, source=address)
+                download_mbps = round(download_bps / 1_000_000, 2)
+                upload_mbps = round(upload_bps / 1_000_000, 2)
             ping_ms = round(s.results.ping, 2)
 
             best = s.get_best_server()
@@ -105,6 +140,9 @@ def measure_speed_python(max_attempts=3, backoff=20):
                 "ping": ping_ms,
                 "server": server_host,
                 "ip": ip_addr,
+                "test_mode": mode,
+                "bytes_used": s.results.bytes_received + s.results.bytes_sent,
+                **latency,
             }
         except Exception as e:
             last_err = e
@@ -133,7 +171,9 @@ def measure_speed_cli():
                     ping_ms = round(float(data["ping"]), 2)
                     server_host = data["server"].get("host") or f"{data['server'].get('name','')}".strip()
                     ip_addr = data["client"].get("ip", "unknown")
-                    return {"download": download_mbps, "upload": upload_mbps, "ping": ping_ms, "server": server_host or "unknown", "ip": ip_addr}
+                    return {"download": download_mbps, "upload": upload_mbps, "ping": ping_ms, "server": server_host or "unknown", "ip": ip_addr,
+                            "test_mode": "full", "bytes_used": data.get("bytes_sent", 0) + data.get("bytes_received", 0),
+                            **dict.fromkeys(LATENCY_FIELDS)}
                 # Ookla JSON
                 if data.get("type") == "result":
                     dl = data.get("download", {}).get("bandwidth")
@@ -144,7 +184,10 @@ def measure_speed_cli():
                         upload_mbps = round((ul * 8) * 8 / 1_000_000, 2) if isinstance(ul, (int, float)) else None
                         server_host = (data.get("server", {}) or {}).get("host", "unknown")
                         ip_addr = (data.get("interface", {}) or {}).get("externalIp", "unknown")
-                        return {"download": download_mbps, "upload": upload_mbps, "ping": round(float(ping_ms), 2), "server": server_host, "ip": ip_addr}
+                        return {"download": download_mbps, "upload": upload_mbps, "ping": round(float(ping_ms), 2), "server": server_host, "ip": ip_addr,
+                                "test_mode": "full",
+                                "bytes_used": (data.get("download", {}).get("bytes") or 0) + (data.get("upload", {}).get("bytes") or 0),
+                                **from_ookla(data)}
             else:
                 print(f"[speedtest-cli] فشل التشغيل ({exe}), rc={cp.returncode}, err={cp.stderr[:200]}")
         except FileNotFoundError:
@@ -153,33 +196,27 @@ def measure_speed_cli():
             print(f"[speedtest-cli] استثناء: {e}")
     raise RuntimeError("تعذر تشغيل speedtest CLI. تأكد أن 'speedtest' في PATH أو ثبّت speedtest-cli.")
 
-def measure_speed():
+def measure_speed(mode="full", source=None, engine_url=None):
+    from speed_engine import measure_http
+    if engine_url:
+        return measure_http(engine_url, source, mode)
     try:
-        return measure_speed_python()
+        return measure_speed_python(mode=mode, source=source)
     except Exception as e:
+        if mode != "full":
+            raise  # the CLI fallback always runs a full test, which the data budget did not allow
+        if source:
+            raise  # the CLI fallback cannot be bound, so it could measure the other line
         print(f"[تحذير] قياس السرعة عبر بايثون فشل ({e}). المحاولة عبر CLI...")
         return measure_speed_cli()
 
 # -------- Logging --------
-def ensure_log_header(path):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    if not os.path.exists(path):
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                "timestamp", "download_mbps", "upload_mbps", "ping_ms",
-                "server", "ip", "device",
-                "school_code", "sector", "school_name",
-                "provider", "line_number", "service_type", "schedule_label", "submit_status", "used_mapping", "used_hidden"
-            ])
-
 def append_log(path, row):
-    with open(path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(row)
+    # Header creation + locked append are handled by the shared writer
+    get_writer(path, LOG_HEADER).write(row)
 
 # -------- Submit to Google Form --------
-def build_payload_base(results, ts):
+def build_payload_base(results, ts, mid):
     if SCHOOL_SECTOR not in ALLOWED_SECTORS:
         raise ValueError(f"Invalid sector '{SCHOOL_SECTOR}'. Allowed: {ALLOWED_SECTORS}")
     if SERVICE_PROVIDER not in ALLOWED_PROVIDERS:
@@ -194,8 +231,13 @@ def build_payload_base(results, ts):
         f"السيرفر: {results['server']} | "
         f"IP: {results['ip']} | "
         f"الجهاز: {DEVICE_NAME} | "
-        f"التاريخ/الوقت: {ts}"
+        f"التاريخ/الوقت: {ts} | "
+        f"المعرف: {mid}"
     )
+    if latency_note(results):
+        notes_text += " | " + latency_note(results)
+    if mode_note(results):
+        notes_text += " | " + mode_note(results)
 
     base = {
         ENTRY_TEXT_IDS["Q1_school_code"]: str(SCHOOL_CODE),
@@ -206,8 +248,9 @@ def build_payload_base(results, ts):
 
     return base, notes_text
 
-def try_submit_with_mapping(mapping, hidden_extra, results, ts):
-    base, notes_text = build_payload_base(results, ts)
+def try_submit_with_mapping(mapping, hidden_extra, results, ts, mid, session=None):
+    import requests
+    base, notes_text = build_payload_base(results, ts, mid)
     q3_id = ENTRY_TEXT_IDS[mapping["Q3_school_name"]]
     q5_id = ENTRY_TEXT_IDS[mapping["Q5_line_number"]]
     q7_id = ENTRY_TEXT_IDS[mapping["Q7_internet_speed"]]
@@ -227,29 +270,66 @@ def try_submit_with_mapping(mapping, hidden_extra, results, ts):
         "Referer": "https://docs.google.com/forms/d/e/1FAIpQLSfoYtl3gmt9FYa7g39v4az1OOtrkYHDcfAX6M-vhI6J-hX50A/viewform",
     }
 
-    r = requests.post(FORM_ACTION_URL, data=payload, headers=headers, timeout=30)
+    # 302 is the acknowledgement; following it only risks a timeout after success
+    r = (session or requests).post(FORM_ACTION_URL, data=payload, headers=headers, timeout=30, allow_redirects=False)
     return (r.status_code in (200, 302)), r.status_code, r.text[:500]
 
-def submit_official(results, ts):
+def submit_official(results, ts, mid, dedup, session=None):
+    import requests
     # Try all mapping x hidden combinations
     last_status = (False, None, "")
     used_mapping = None
     used_hidden = None
     for mapping in TEXT_MAPPING_TRIES:
         for hidden in HIDDEN_CANDIDATES:
-            ok, code, preview = try_submit_with_mapping(mapping, hidden, results, ts)
+            # Checked before every POST: an earlier try/run may already have landed it
+            if dedup.seen(FORM_ACTION_URL, mid):
+                print(f"- المعرف {mid} مُرسل مسبقًا، لا حاجة لإعادة الإرسال.")
+                return True, None, f"already submitted ({mid})", used_mapping, used_hidden
+            try:
+                ok, code, preview = try_submit_with_mapping(mapping, hidden, results, ts, mid, session)
+            except requests.RequestException as e:
+                ok, code, preview = False, None, str(e)
             print(f"- تجربة mapping={mapping} hidden={hidden} => Status {code}")
             last_status = (ok, code, preview)
             if ok:
+                dedup.mark(FORM_ACTION_URL, mid, code)
                 used_mapping = mapping
                 used_hidden = hidden
                 return True, code, preview, used_mapping, used_hidden
     return False, last_status[1], last_status[2], used_mapping, used_hidden
 
 # -------- Scheduler helpers --------
-def run_once(schedule_label):
+def run_once(schedule_label, dispatcher=None):
     print(f"\n[{schedule_label}] بدء القياس والإرسال...")
-    results = measure_speed()
+    lease, key, holder = open_lease(LEASE_DIR), slot_key(SCHOOL_CODE, LINE_NUMBER, schedule_label), None
+    if lease is not None:
+        held, info = claim(lease, key, DEVICE_NAME)
+        if not held:
+            holder = info["device"]
+            if info.get("finished"):
+                print(f"[{schedule_label}] تم قياس هذا الخط في هذا الموعد ({holder}: {info.get('status')})؛ تم التخطي.")
+                return
+            if LEASE_FOLLOWER == "skip":
+                print(f"[{schedule_label}] الجهاز {holder} يقيس هذا الخط في هذا الموعد؛ تم التخطي.")
+                return
+            print(f"[{schedule_label}] الجهاز {holder} يقيس هذا الخط في هذا الموعد؛ قياس التأخير فقط دون إرسال.")
+    mode, budget = ("full" if holder is None else "latency"), None
+    if is_metered(SERVICE_TYPE):
+        budget = DataBudget(BUDGET_FILE)
+        if holder is None:
+            mode = budget.choose_mode(LINE_NUMBER, DATA_BUDGET_MB, schedule_label, SCHEDULES)
+            if mode != "full":
+                print(f"[{schedule_label}] باقة البيانات: تشغيل اختبار '{mode}' بدل الاختبار الكامل.")
+    try:
+        results = measure_speed(mode, SOURCE or None, ENGINE_URL or None)
+    except Exception:
+        if lease is not None and holder is None:
+            give_back(lease, key, DEVICE_NAME)  # let another device measure this slot
+        raise
+    if budget is not None:
+        acct = budget.charge(LINE_NUMBER, results["test_mode"], results["bytes_used"])
+        print(f"[{schedule_label}] استهلاك الباقة هذا الشهر: {acct['used'] / 1_000_000:.0f} / {DATA_BUDGET_MB} MB")
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     print("نتائج السرعة: "
@@ -258,17 +338,58 @@ def run_once(schedule_label):
           f"Ping {results['ping']} ms | "
           f"سيرفر {results['server']} | IP {results['ip']}")
 
-    ensure_log_header(LOG_FILE)
-
-    ok, code, preview, used_mapping, used_hidden = submit_official(results, ts)
-    status_txt = "SUCCESS" if ok else f"FAIL({code})"
-    append_log(LOG_FILE, [
-        ts, results["download"], results["upload"], results["ping"],
-        results["server"], results["ip"], DEVICE_NAME,
-        SCHOOL_CODE, SCHOOL_SECTOR, SCHOOL_NAME,
-        SERVICE_PROVIDER, LINE_NUMBER, SERVICE_TYPE, schedule_label, status_txt,
-        str(used_mapping), str(used_hidden)
-    ])
+    if holder is not None:
+        # follower: the holder submits this slot; keep the probes locally only
+        append_log(LOG_FILE, Measurement.from_results(
+            results, timestamp=ts, device=DEVICE_NAME,
+            school_code=SCHOOL_CODE, sector=SCHOOL_SECTOR, school_name=SCHOOL_NAME,
+            provider=SERVICE_PROVIDER, line_number=LINE_NUMBER, service_type=SERVICE_TYPE,
+            schedule_label=schedule_label, submit_status=f"LEASE({holder})", source=SOURCE,
+            used_mapping="None", used_hidden="None"))
+        return
+
+    if results["test_mode"] == "latency":
+        # the budget allows no throughput test: nothing to answer Q7 with, keep the probes locally
+        status_txt = "NOT_SUBMITTED(latency)"
+        append_log(LOG_FILE, Measurement.from_results(
+            results, timestamp=ts, device=DEVICE_NAME,
+            school_code=SCHOOL_CODE, sector=SCHOOL_SECTOR, school_name=SCHOOL_NAME,
+            provider=SERVICE_PROVIDER, line_number=LINE_NUMBER, service_type=SERVICE_TYPE,
+            schedule_label=schedule_label, submit_status=status_txt, source=SOURCE,
+            used_mapping="None", used_hidden="None"))
+        if lease is not None:
+            give_back(lease, key, DEVICE_NAME, status_txt)
+        print(f"[{schedule_label}] قياس التأخير فقط؛ لم يتم الإرسال (باقة البيانات).")
+        return
+
+    if dispatcher is not None:
+        # sinks.json: hand off to every sink in parallel and return without waiting
+        m = Measurement.from_results(
+            results, timestamp=ts, device=DEVICE_NAME,
+            school_code=SCHOOL_CODE, sector=SCHOOL_SECTOR, school_name=SCHOOL_NAME,
+            provider=SERVICE_PROVIDER, line_number=LINE_NUMBER, service_type=SERVICE_TYPE,
+            schedule_label=schedule_label, source=SOURCE)
+        dispatcher.dispatch(m, measurement_id(SCHOOL_CODE, LINE_NUMBER, ts))
+        if lease is not None:
+            give_back(lease, key, DEVICE_NAME, "DISPATCHED")
+        print(f"[{schedule_label}] تم تسليم النتيجة إلى {len(dispatcher.sinks)} وجهة بالتوازي.")
+        return
+
+    mid = measurement_id(SCHOOL_CODE, LINE_NUMBER, ts)
+    ok, code, preview, used_mapping, used_hidden = submit_official(
+        results, ts, mid, DedupIndex(DEDUP_FILE), bound_session(SOURCE))
+    if ok and code is None:
+        status_txt = "DUPLICATE"
+    else:
+        status_txt = "SUCCESS" if ok else f"FAIL({code})"
+    append_log(LOG_FILE, Measurement.from_results(
+        results, timestamp=ts, device=DEVICE_NAME,
+        school_code=SCHOOL_CODE, sector=SCHOOL_SECTOR, school_name=SCHOOL_NAME,
+        provider=SERVICE_PROVIDER, line_number=LINE_NUMBER, service_type=SERVICE_TYPE,
+        schedule_label=schedule_label, submit_status=status_txt, source=SOURCE,
+        used_mapping=str(used_mapping), used_hidden=str(used_hidden)))
+    if lease is not None:
+        give_back(lease, key, DEVICE_NAME, status_txt)
 
     if ok:
         print(f"[{schedule_label}] تم الإرسال بنجاح ✅ (HTTP {code})")
@@ -276,57 +397,92 @@ def run_once(schedule_label):
         print(f"[{schedule_label}] فشل الإرسال ❌ (HTTP {code})")
         print("Preview:", preview)
 
-def next_dt_for(hour, minute, today=None):
+def run_and_watch(schedule_label, detector, dispatcher=None):
+    """run_once + feed the new log row(s) to the anomaly detector; maybe follow up."""
+    run_once(schedule_label, dispatcher)
+    if dispatcher is not None:
+        dispatcher.drain(CSV_SINK_WAIT, ["csv"])  # the row is written on the CSV sink's thread
+    alerts = [a for a in detector.poll() if a["school"] == str(SCHOOL_CODE)]
+    for a in alerts:
+        print(format_alert(a))
+    if alerts and ANOMALY_FOLLOWUP:
+        label = f"{schedule_label}-followup"
+        if is_metered(SERVICE_TYPE) and DataBudget(BUDGET_FILE).choose_mode(
+                LINE_NUMBER, DATA_BUDGET_MB, label, SCHEDULES) == "latency":
+            print(f"[{schedule_label}] تم رصد تدهور؛ باقة البيانات لا تسمح بقياس متابعة هذا الشهر.")
+            return
+        print(f"[{schedule_label}] تم رصد تدهور؛ إجراء قياس متابعة فوري...")
+        run_once(label, dispatcher)
+        if dispatcher is not None:
+            dispatcher.drain(CSV_SINK_WAIT, ["csv"])
+        for a in detector.poll():
+            if a["school"] == str(SCHOOL_CODE):
+                print(format_alert(a))
+
+def next_dt_for(hour, minute, today=None, now=None):
     if today is None:
         today = date.today()
     candidate = datetime.combine(today, datetime.min.time()).replace(hour=hour, minute=minute)
-    now = datetime.now()
+    if now is None:
+        now = datetime.now()
     if candidate <= now:
         candidate += timedelta(days=1)
     return candidate
 
-def loop_scheduler():
+def loop_scheduler(clock=None, job=None):
+    # Optional fan-out (sinks.json); imported here because speed_sinks imports this module
+    from speed_sinks import load_dispatcher
     print("سيعمل السكربت تلقائيًا مرتين يوميًا: 07:00 و 13:30.")
     print("اترك النافذة مفتوحة أو شغّل من Task Scheduler/Startup للتشغيل الصامت.")
 
+    clock = clock or SystemClock()
     last_run = {label: None for (label, _, _) in SCHEDULES}
+    if job is None:
+        detector = AnomalyDetector(ANOMALY_STATE_FILE, LOG_FILE)
+        dispatcher = load_dispatcher(DedupIndex(DEDUP_FILE))
+        if dispatcher is not None:
+            print("الوجهات المفعّلة: " + ", ".join(s.name for s in dispatcher.sinks))
+        job = lambda label: run_and_watch(label, detector, dispatcher)
 
     while True:
-        now = datetime.now()
+        now = clock.now()
         ran_any = False
 
         for (label, h, m) in SCHEDULES:
-            sched_today = datetime.combine(date.today(), datetime.min.time()).replace(hour=h, minute=m)
-            if now >= sched_today and last_run[label] != date.today():
-                run_once(label)
-                last_run[label] = date.today()
+            sched_today = datetime.combine(clock.today(), datetime.min.time()).replace(hour=h, minute=m)
+            if now >= sched_today and last_run[label] != clock.today():
+                job(label)
+                last_run[label] = clock.today()
                 ran_any = True
 
         if ran_any:
-            time.sleep(30)
+            clock.sleep(30)
             continue
 
         upcoming = []
         for (label, h, m) in SCHEDULES:
-            sched_today = datetime.combine(date.today(), datetime.min.time()).replace(hour=h, minute=m)
-            if last_run[label] == date.today():
-                sched = next_dt_for(h, m, date.today())
+            sched_today = datetime.combine(clock.today(), datetime.min.time()).replace(hour=h, minute=m)
+            if last_run[label] == clock.today():
+                sched = next_dt_for(h, m, clock.today() + timedelta(days=1), clock.now())
             else:
-                sched = next_dt_for(h, m, date.today())
-                if datetime.now() < sched_today:
+                sched = next_dt_for(h, m, clock.today(), clock.now())
+                if clock.now() < sched_today:
                     sched = sched_today
             upcoming.append((sched, label))
 
         next_time, next_label = min(upcoming, key=lambda x: x[0])
-        wait_seconds = max(5, int((next_time - datetime.now()).total_seconds()))
+        wait_seconds = max(5, int((next_time - clock.now()).total_seconds()))
         print(f"ينام حتى {next_time.strftime('%Y-%m-%d %H:%M')} للحدث [{next_label}] (~{wait_seconds//60} دقيقة).")
         while wait_seconds > 0:
             nap = min(wait_seconds, 300)
-            time.sleep(nap)
-            wait_seconds = int((next_time - datetime.now()).total_seconds())
+            clock.sleep(nap)
+            wait_seconds = int((next_time - clock.now()).total_seconds())
 
-        run_once(next_label)
-        last_run[next_label] = date.today()
+        if clock.today() != next_time.date():
+            # woke from suspend on a later day: that slot is gone, let catch-up handle today
+            continue
+        job(next_label)
+        last_run[next_label] = clock.today()
 
 def main():
     loop_scheduler()
@@ -17,6 +17,7 @@
 - ربط ملاحظاتك مع entry.899161738 مباشرة.
 - إعادة محاولات تلقائية مع Backoff عند فشل الإرسال.
 - تسجيل محلي للنتائج في CSV (logs/speed_log.csv).
+- معرّف ثابت لكل قياس وفهرس محلي يمنع الإرسال المكرر (logs/submitted_ids.jsonl).
 - التحقق من صحة القيم (مزود/قطاع/خدمة).
 - ترويسة HTTP مناسبة.
 
@@ -30,19 +31,16 @@
 """
 
 import os
-import csv
 import time
 import platform
 from pathlib import Path
 from datetime import datetime
 import argparse
-import requests
-
-try:
-    import speedtest  # from speedtest-cli
-except ImportError as e:
-    raise SystemExit("الرجاء تثبيت speedtest-cli أولاً: pip install speedtest-cli") from e
 
+from speed_dedup import DedupIndex, measurement_id
+from speed_logwriter import get_writer
+from speed_record import Measurement
+from speed_latency import LATENCY_FIELDS, latency_note, run_loaded
 
 # ---------- إعدادات ثابتة للنموذج ----------
 FORM_URL = "https://docs.google.com/forms/d/e/1FAIpQLSfoYtl3gmt9FYa7g39v4az1OOtrkYHDcfAX6M-vhI6J-hX50A/formResponse"
@@ -62,6 +60,7 @@ VALID_SERVICES  = {"فايبر","الجيل الخامس 5 G"}
 
 LOG_DIR  = Path("logs")
 LOG_FILE = LOG_DIR / "speed_log.csv"
+DEDUP_FILE = LOG_DIR / "submitted_ids.jsonl"  # الإرسالات المؤكدة (تبقى بعد إعادة التشغيل)
 
 
 def bps_to_mbps(bps: float) -> float:
@@ -69,11 +68,14 @@ def bps_to_mbps(bps: float) -> float:
 
 
 def measure_speed(timeout_sec: int = 30) -> dict:
+    try:
+        import speedtest  # from speedtest-cli
+    except ImportError as e:
+        raise SystemExit("الرجاء تثبيت speedtest-cli أولاً: pip install speedtest-cli") from e
     st = speedtest.Speedtest(timeout=timeout_sec)
     st.get_servers([])
     st.get_best_server()
-    download_bps = st.download()
-    upload_bps   = st.upload()
+    download_bps, upload_bps, latency = run_loaded(st)
     ping_ms      = st.results.ping
     return {
         "download_mbps": bps_to_mbps(download_bps),
@@ -82,11 +84,11 @@ def measure_speed(timeout_sec: int = 30) -> dict:
         "server":        st.results.server.get("host", ""),
         "sponsor":       st.results.server.get("sponsor", ""),
         "client_ip":     st.results.client.get("ip", ""),
+        **latency,
     }
 
 
-def build_speed_text(results: dict) -> str:
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def build_speed_text(results: dict, ts: str, mid: str) -> str:
     lines = [
         f"التاريخ/الوقت: {ts}",
         f"تنزيل (Mbps): {results['download_mbps']}",
@@ -95,11 +97,16 @@ def build_speed_text(results: dict) -> str:
         f"السيرفر: {results['server']} ({results['sponsor']})",
         f"IP العميل: {results['client_ip']}",
         f"الجهاز: {platform.node()}",
+        f"المعرف: {mid}",
     ]
+    if latency_note(results):
+        lines.append(latency_note(results))
     return "\n".join(lines)
 
 
-def submit_to_form(payload: dict, retries: int = 3, backoff_sec: float = 2.0) -> bool:
+def submit_to_form(payload: dict, mid: str, dedup: DedupIndex,
+                   retries: int = 3, backoff_sec: float = 2.0) -> bool:
+    import requests
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
                       "(KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
@@ -107,9 +114,16 @@ def submit_to_form(payload: dict, retries: int = 3, backoff_sec: float = 2.0) ->
         "Origin": "https://docs.google.com",
     }
     for attempt in range(1, retries + 1):
+        # تحقّق قبل كل POST: قد تكون محاولة سابقة وصلت رغم انتهاء المهلة
+        if dedup.seen(FORM_URL, mid):
+            print(f"[معلومة] القياس {mid} مُرسل مسبقًا، تم تخطي الإرسال.")
+            return True
         try:
-            resp = requests.post(FORM_URL, data=payload, headers=headers, timeout=30)
-            if resp.status_code == 200:
+            # 302 يعني القبول؛ تتبّعه يعرّضنا لمهلة بعد نجاح فعلي
+            resp = requests.post(FORM_URL, data=payload, headers=headers, timeout=30,
+                                 allow_redirects=False)
+            if resp.status_code in (200, 302):
+                dedup.mark(FORM_URL, mid, resp.status_code)
                 return True
             else:
                 print(f"[تحذير] حالة HTTP غير متوقعة: {resp.status_code} (محاولة {attempt}/{retries})")
@@ -119,20 +133,15 @@ def submit_to_form(payload: dict, retries: int = 3, backoff_sec: float = 2.0) ->
     return False
 
 
-def log_to_csv(row: dict):
-    LOG_DIR.mkdir(parents=True, exist_ok=True)
-    new_file = not LOG_FILE.exists()
+def log_to_csv(row: Measurement):
     # ثبّت ترتيب الأعمدة
     fieldnames = [
         "timestamp","download_mbps","upload_mbps","ping_ms",
         "server","sponsor","client_ip","sector","provider",
         "service_type","line_number"
-    ]
-    with LOG_FILE.open("a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if new_file:
-            writer.writeheader()
-        writer.writerow(row)
+    ] + list(LATENCY_FIELDS)
+    # الترويسة والقفل والكتابة المجمّعة يتولاها الكاتب المشترك
+    get_writer(LOG_FILE, fieldnames).write(row)
 
 
 def parse_args():
@@ -159,25 +168,22 @@ def main():
 
     print("بدء قياس السرعة... قد يستغرق الأمر دقيقة.")
     results = measure_speed(timeout_sec=args.timeout)
-    speed_text = build_speed_text(results)
+    now = datetime.now()
+    mid = measurement_id(args.school_code, args.line_number, now.isoformat(timespec="seconds"))
+    speed_text = build_speed_text(results, now.strftime("%Y-%m-%d %H:%M:%S"), mid)
 
     print("\nنتائج السرعة:")
     print(speed_text)
 
     # سجل محليًا دائمًا
-    log_row = {
-        "timestamp": datetime.now().isoformat(timespec="seconds"),
-        "download_mbps": results["download_mbps"],
-        "upload_mbps": results["upload_mbps"],
-        "ping_ms": results["ping_ms"],
-        "server": results["server"],
-        "sponsor": results["sponsor"],
-        "client_ip": results["client_ip"],
-        "sector": args.sector,
-        "provider": args.provider,
-        "service_type": args.service_type,
-        "line_number": args.line_number,
-    }
+    log_row = Measurement.from_results(
+        results,
+        timestamp=now.isoformat(timespec="seconds"),
+        sector=args.sector,
+        provider=args.provider,
+        service_type=args.service_type,
+        line_number=args.line_number,
+    )
     log_to_csv(log_row)
     print(f"\nتم حفظ نتيجة محليًا في: {LOG_FILE.resolve()}")
 
@@ -202,7 +208,8 @@ def main():
     }
 
     print("\nجارٍ إرسال النتائج إلى Google Form...")
-    ok = submit_to_form(payload, retries=args.retries, backoff_sec=args.backoff)
+    ok = submit_to_form(payload, mid, DedupIndex(str(DEDUP_FILE)),
+                        retries=args.retries, backoff_sec=args.backoff)
 
     if ok:
         print("تم الإرسال بنجاح ✅")